@@ -19,18 +19,39 @@
 import json
 import asyncio
 import base64
+import hashlib
+import io
+import logging
+import logging.handlers
+import math
+import queue
+import random
 import re
-from typing import Optional, List, Dict, Any, Tuple
-from datetime import datetime
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from heapq import nlargest
+from importlib.util import find_spec
+from operator import itemgetter
+from types import ModuleType
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Set, Tuple, Coroutine, Union
+from datetime import datetime, timezone
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import urlsplit
 
 from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
 # Crawl4AI imports
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, SemaphoreDispatcher
 from crawl4ai.extraction_strategy import (
     LLMExtractionStrategy,
     JsonCssExtractionStrategy,
@@ -54,22 +75,60 @@
 # =============================================================================
 
 try:
-    from supabase import create_client, Client
+    import httpx  # supabase-py's HTTP transport
+    from supabase import Client, ClientOptions, create_client
     SUPABASE_AVAILABLE = True
 except ImportError:
     SUPABASE_AVAILABLE = False
 
 try:
-    from openai import AzureOpenAI
+    from openai import APIConnectionError, AsyncAzureOpenAI, InternalServerError, RateLimitError
     AZURE_OPENAI_AVAILABLE = True
 except ImportError:
     AZURE_OPENAI_AVAILABLE = False
 
 try:
-    from neo4j import GraphDatabase
+    from neo4j import READ_ACCESS, AsyncGraphDatabase
     NEO4J_AVAILABLE = True
 except ImportError:
     NEO4J_AVAILABLE = False
+    READ_ACCESS = "READ"  # Same value as neo4j.READ_ACCESS
+
+# =============================================================================
+# Optional speedups (pip install ".[speedups]")
+# =============================================================================
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+b64: ModuleType
+try:
+    import pybase64 as b64  # SIMD base64, same API as the stdlib module
+    PYBASE64_AVAILABLE = True
+except ImportError:
+    b64 = base64
+    PYBASE64_AVAILABLE = False
+
+try:
+    import hyperscan  # SIMD multi-pattern matcher (x86-64 wheels only)
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    HYPERSCAN_AVAILABLE = False
+
+try:
+    import uvloop  # Not available on Windows; the stock asyncio loop is used there
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
 
 # =============================================================================
 # Configuration
@@ -89,6 +148,40 @@
 # Azure embedding deployment name (you may need to adjust this based on your deployment)
 AZURE_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
 
+# Embedding batching: concurrent vector DB writes are coalesced into one
+# embeddings request + one upsert per batch window / token budget
+EMBEDDING_BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW", "0.1"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "6000"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+# In-process LRU of embeddings keyed by content hash (re-crawls skip the API)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+# Optional sqlite file that keeps embeddings across restarts (unset = disabled)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+# Search query embeddings keyed by normalized query text (repeat searches skip
+# the embeddings API entirely); entries expire after QUERY_CACHE_TTL seconds
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+# Recently crawled pages are served from memory for PAGE_CACHE_TTL seconds
+# (0 disables); tools take force_refresh=True to always load the page again
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "64"))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "300"))
+# Concurrent embeddings requests (match the deployment's RPM/TPM quota) and
+# how often a rate-limited / 5xx / dropped request is retried with backoff
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+# Pages shorter than this (after stripping whitespace) are not embedded, and a
+# page body seen at this many distinct URLs is treated as boilerplate
+# (login walls, soft 404s) and not stored again
+EMBEDDING_MIN_CHARS = int(os.getenv("EMBEDDING_MIN_CHARS", "200"))
+BOILERPLATE_URL_THRESHOLD = int(os.getenv("BOILERPLATE_URL_THRESHOLD", "3"))
+# Pages are stored as chunks of at most this many characters (~512 tokens)
+EMBEDDING_CHUNK_CHARS = int(os.getenv("EMBEDDING_CHUNK_CHARS", "2048"))
+
+# Logging (always to stderr: stdout carries the MCP stdio transport)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
 # Supabase configuration (for vector storage)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_SERVICE_KEY")
@@ -98,6 +191,8 @@
 NEO4J_USERNAME = os.getenv("NEO4J_USERNAME") or os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 
+logger = logging.getLogger(__name__)
+
 # Feature flags
 RAG_AVAILABLE = (
     SUPABASE_AVAILABLE
@@ -140,7 +235,7 @@ class CrawlResult(BaseModel):
     content: str
     links: Optional[List[str]] = None
     images: Optional[List[str]] = None
-    crawled_at: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    crawled_at: str = Field(default_factory=lambda: utc_now_iso())
     success: bool = True
     error: Optional[str] = None
     stored_in_db: bool = False
@@ -159,9 +254,19 @@ class CrawlResult(BaseModel):
 # Global instances (initialized lazily)
 _crawler: Optional[AsyncWebCrawler] = None
 _crawler_lock = asyncio.Lock()
+# Caps browser pages loading at once across all tools (batch crawls reserve permits)
+_crawl_semaphore = asyncio.BoundedSemaphore(MAX_CONCURRENT)
+_crawl_reserve_lock = asyncio.Lock()
 _supabase: Optional[Any] = None
+_supabase_http: Optional[Any] = None
 _azure_client: Optional[Any] = None
 _neo4j_driver: Optional[Any] = None
+_embedding_batcher: Optional["EmbeddingBatcher"] = None
+_embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+_embedding_disk_cache: Optional["EmbeddingDiskCache"] = None
+_embedding_semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+_page_hash_urls: "OrderedDict[str, Set[str]]" = OrderedDict()
+_background_tasks: Set[asyncio.Task] = set()
 
 
 async def get_crawler() -> AsyncWebCrawler:
@@ -179,25 +284,61 @@ async def get_crawler() -> AsyncWebCrawler:
 
 
 def get_supabase() -> Optional[Any]:
-    """Get or create Supabase client for vector RAG."""
-    global _supabase
+    """
+    Get or create Supabase client for vector RAG.
+    PostgREST, auth and storage share one keep-alive (HTTP/2 when h2 is
+    installed) connection pool, so concurrent upserts and RPCs multiplex
+    over warm connections instead of reconnecting.
+    """
+    global _supabase, _supabase_http
     if not SUPABASE_AVAILABLE:
         return None
     if _supabase is None and SUPABASE_URL and SUPABASE_SERVICE_KEY:
-        _supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+        http = httpx.Client(
+            http2=find_spec("h2") is not None,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=30.0,
+            follow_redirects=True,
+        )
+        options: Optional[ClientOptions] = None
+        try:
+            options = ClientOptions(httpx_client=http)
+        except TypeError:
+            # supabase-py releases before the httpx_client option manage their own pool
+            http.close()
+        _supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY, options=options)
+        _supabase_http = http if options is not None else None
     return _supabase
 
 
+def warm_supabase_connection() -> None:
+    """
+    Make sure the shared Supabase pool holds a live connection (idle ones are
+    dropped after a few seconds), so the next RPC skips the TCP/TLS handshake.
+    The response itself is ignored.
+    """
+    if _supabase_http is None:
+        return
+    try:
+        _supabase_http.head(f"{SUPABASE_URL}/rest/v1/")
+    except Exception as e:
+        logger.debug("Supabase warmup request failed: %s", e)
+
+
 def get_azure_openai() -> Optional[Any]:
-    """Get or create Azure OpenAI client for embeddings."""
+    """
+    Get or create the async Azure OpenAI client for embeddings.
+    The client is shared so all embedding calls reuse one HTTP connection pool.
+    """
     global _azure_client
     if not AZURE_OPENAI_AVAILABLE:
         return None
     if _azure_client is None and AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY:
-        _azure_client = AzureOpenAI(
+        _azure_client = AsyncAzureOpenAI(
             azure_endpoint=AZURE_OPENAI_ENDPOINT,
             api_key=AZURE_OPENAI_API_KEY,
             api_version=AZURE_OPENAI_API_VERSION,
+            max_retries=0,  # Retries (with backoff and the concurrency cap) are done by create_embeddings
         )
     return _azure_client
 
@@ -208,226 +349,1337 @@ def get_neo4j_driver() -> Optional[Any]:
     if not NEO4J_AVAILABLE:
         return None
     if _neo4j_driver is None and NEO4J_URI and NEO4J_PASSWORD:
-        _neo4j_driver = GraphDatabase.driver(
+        _neo4j_driver = AsyncGraphDatabase.driver(
             NEO4J_URI,
-            auth=(NEO4J_USERNAME, NEO4J_PASSWORD)
+            auth=(NEO4J_USERNAME, NEO4J_PASSWORD),
+            max_connection_pool_size=32,
+            max_connection_lifetime=3600
         )
     return _neo4j_driver
 
 
+class BrowserSessionPool:
+    """
+    Hand out Crawl4AI session ids so sequential tool calls reuse a warm page.
+
+    A session is used by one call at a time; concurrent calls each get their
+    own. Sessions whose crawl raised are killed rather than reused.
+    """
+
+    def __init__(self, prefix: str = "mcp-session"):
+        self.prefix = prefix
+        self._idle: List[str] = []
+        self._sessions: List[str] = []
+        self._created = 0
+
+    async def arun(self, crawler: AsyncWebCrawler, url: str, config: CrawlerRunConfig) -> Any:
+        """Run crawler.arun on a pooled session, at most MAX_CONCURRENT at a time."""
+        async with _crawl_semaphore:
+            return await self._arun(crawler, url, config)
+
+    async def _arun(self, crawler: AsyncWebCrawler, url: str, config: CrawlerRunConfig) -> Any:
+        if self._idle:
+            session_id = self._idle.pop()
+        else:
+            session_id = f"{self.prefix}-{self._created}"
+            self._created += 1
+            self._sessions.append(session_id)
+
+        config.session_id = session_id
+        try:
+            result = await crawler.arun(url=url, config=config)
+        except BaseException:
+            self._sessions.remove(session_id)
+            await self._kill(crawler, session_id)
+            raise
+        self._idle.append(session_id)
+        return result
+
+    async def _kill(self, crawler: AsyncWebCrawler, session_id: str) -> None:
+        try:
+            await crawler.crawler_strategy.kill_session(session_id)
+        except Exception:
+            logger.exception("Failed to close browser session %s", session_id)
+
+    async def close(self, crawler: AsyncWebCrawler) -> None:
+        """Close every pooled session's page and context."""
+        for session_id in self._sessions:
+            await self._kill(crawler, session_id)
+        self._sessions.clear()
+        self._idle.clear()
+
+
+_session_pool = BrowserSessionPool()
+
+
+@asynccontextmanager
+async def reserve_crawl_slots(count: int) -> AsyncIterator[None]:
+    """
+    Hold `count` permits of the shared crawl limit while a batch crawl runs
+    up to `count` pages at once outside the session pool. Permits are taken
+    under a lock so two batches can never each hold part of the budget and
+    wait on each other.
+    """
+    taken = 0
+    try:
+        async with _crawl_reserve_lock:
+            for _ in range(count):
+                await _crawl_semaphore.acquire()
+                taken += 1
+        yield
+    finally:
+        for _ in range(taken):
+            _crawl_semaphore.release()
+
+
+class TTLCache:
+    """Small LRU whose entries also expire ttl seconds after they were stored."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: Any) -> None:
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_page_cache = TTLCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL)
+_query_embedding_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+
+async def fetch_page(
+    crawler: AsyncWebCrawler,
+    url: str,
+    config: CrawlerRunConfig,
+    force_refresh: bool = False
+) -> Any:
+    """
+    Crawl a page on a pooled session, reusing a fresh successful result for
+    the same URL and content-affecting options unless force_refresh is set.
+    """
+    key = (url, config.wait_for, config.word_count_threshold)
+    if not force_refresh:
+        cached = _page_cache.get(key)
+        if cached is not None:
+            return cached
+
+    result = await _session_pool.arun(crawler, url, config)
+    if result.success:
+        _page_cache.put(key, result)
+    return result
+
+
 # =============================================================================
 # Helper Functions
 # =============================================================================
 
+TRUNCATION_SUFFIX = "\n\n[Content truncated for length...]"
+
+
+def utc_now_iso() -> str:
+    """Current time as a timezone-aware ISO 8601 string (UTC)."""
+    return datetime.now(timezone.utc).isoformat()
+
+
 def truncate_content(content: str, max_length: int = 50000) -> str:
-    """Truncate content to stay within token limits."""
+    """
+    Truncate content to stay within token limits.
+    Returns the original string (no copy) when it already fits; callers should
+    pass the full content rather than pre-slicing it.
+    """
     if len(content) <= max_length:
         return content
-    return content[:max_length] + "\n\n[Content truncated for length...]"
+    return content[:max_length] + TRUNCATION_SUFFIX
+
+
+def write_truncated(write: Any, content: str, max_length: int = 50000) -> None:
+    """
+    Write content truncated like truncate_content to a StringIO writer.
+    The slice and suffix are written separately, so the joined copy is never built.
+    """
+    if len(content) <= max_length:
+        write(content)
+    else:
+        write(content[:max_length])
+        write(TRUNCATION_SUFFIX)
+
+
+def json_loads(data: Any) -> Any:
+    """Parse JSON, using orjson when installed."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps_pretty(data: Any) -> str:
+    """Serialize JSON with 2-space indentation, using orjson when installed."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode("utf-8")
+        except TypeError:
+            pass  # e.g. non-string keys or integers > 64 bits
+    return json.dumps(data, indent=2)
+
+
+def json_dumps_sorted(data: Any) -> str:
+    """Serialize JSON compactly with sorted keys (a canonical cache key), using orjson when installed."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SORT_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(data, sort_keys=True, separators=(",", ":"))
+
+
+@lru_cache(maxsize=128)
+def _css_strategy(schema_json: str) -> JsonCssExtractionStrategy:
+    return JsonCssExtractionStrategy(json_loads(schema_json))
+
+
+def get_css_strategy(schema: Dict[str, Any]) -> JsonCssExtractionStrategy:
+    """
+    Get a (shared) CSS extraction strategy for a schema.
+    Strategies hold no per-run state, so one instance per distinct schema is reused.
+    """
+    return _css_strategy(json_dumps_sorted(schema))
+
+
+def to_base64(data: Union[bytes, bytearray, memoryview, str]) -> str:
+    """Return base64 text for a payload Crawl4AI gives as raw bytes or already-encoded str."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        encoded: bytes = b64.b64encode(data)
+        return encoded.decode("ascii")
+    return data
+
+
+def format_links(links: List[Dict[str, Any]]) -> str:
+    """Format crawl4ai link dicts as a markdown list, labelled by text (or href)."""
+    return "".join(
+        f"- [{(link.get('text') or link.get('href', ''))[:50]}]({link.get('href', '')})\n"
+        for link in links
+    )
+
+
+def first_unique(items: List[Dict[str, Any]], key: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Return up to limit items with distinct, non-empty item[key], in page order.
+    Nav bars and footers repeat links, so capping before deduplicating would
+    show the same few hrefs over and over.
+    """
+    seen: Set[Any] = set()
+    unique = []
+    for item in items:
+        value = item.get(key)
+        if not value or value in seen:
+            continue
+        seen.add(value)
+        unique.append(item)
+        if len(unique) == limit:
+            break
+    return unique
+
+
+_paragraph_chunker = RegexChunking()
+
+
+def chunk_content(content: str, max_chars: int = EMBEDDING_CHUNK_CHARS) -> List[str]:
+    """
+    Split content into embedding-sized chunks.
+    Paragraphs are packed together up to max_chars; longer ones are hard-split.
+    """
+    chunks: List[str] = []
+    current = ""
+    for para in _paragraph_chunker.chunk(content):
+        if not para.strip():
+            continue
+        while len(para) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:max_chars])
+            para = para[max_chars:]
+        if current and len(current) + 2 + len(para) > max_chars:
+            chunks.append(current)
+            current = para
+        else:
+            current = f"{current}\n\n{para}" if current else para
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def _is_word_char(char: str) -> bool:
+    """Match the definition of \\w used by the query pattern."""
+    return char.isalnum() or char == "_"
+
+
+@lru_cache(maxsize=128)
+def query_pattern(query_terms: Tuple[str, ...]) -> "re.Pattern[str]":
+    """
+    Compile (once per query) a pattern matching any query term as a whole word.
+    Longer terms are tried first so a term never shadows a longer overlapping one.
+    """
+    terms = sorted(set(query_terms), key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(map(re.escape, terms)) + r")(?!\w)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=128)
+def query_automaton(query_terms: Tuple[str, ...]) -> Any:
+    """Build (once per query) an Aho-Corasick automaton over the distinct query terms."""
+    automaton = ahocorasick.Automaton()
+    for term in set(query_terms):
+        automaton.add_word(term, term)
+    automaton.make_automaton()
+    return automaton
+
+
+def score_paragraphs(content: str, query_terms: List[str]) -> List[Tuple[int, str]]:
+    """
+    Score paragraphs by how often query terms occur in them as whole words.
+    Returns (score, paragraph) pairs for substantial paragraphs with a score > 0.
+    """
+    paragraphs = content.split("\n\n")
+    if not query_terms:
+        return []
+
+    weights = Counter(query_terms)
+
+    # Hits are bucketed into paragraphs by their offset in the whole document
+    starts = []
+    offset = 0
+    for para in paragraphs:
+        starts.append(offset)
+        offset += len(para) + 2
+    scores = [0] * len(paragraphs)
+
+    # Single C-level automaton pass over the lowercased document; only valid
+    # when lowering preserved character offsets (a few Unicode characters expand)
+    content_lower = content.lower() if AHOCORASICK_AVAILABLE else None
+    if content_lower is not None and len(content_lower) == len(content):
+        automaton = query_automaton(tuple(weights))
+        last = len(content_lower) - 1
+        hits = []
+        for end, term in automaton.iter(content_lower):
+            start = end - len(term) + 1
+            if start > 0 and _is_word_char(content_lower[start - 1]):
+                continue
+            if end < last and _is_word_char(content_lower[end + 1]):
+                continue
+            hits.append((start, end, term))
+
+        # Same rule as the regex scan: leftmost hit first, the longest term at
+        # a given start, and nothing overlapping a hit already counted
+        hits.sort(key=lambda hit: (hit[0], -hit[1]))
+        counted_until = -1
+        for start, end, term in hits:
+            if start <= counted_until:
+                continue
+            counted_until = end
+            scores[bisect_right(starts, end) - 1] += weights[term]
+    else:
+        # One case-insensitive scan of the original text: no lowercased copy,
+        # and paragraphs without a hit are never touched
+        pattern = query_pattern(tuple(weights))
+        for match in pattern.finditer(content):
+            scores[bisect_right(starts, match.start()) - 1] += weights[match.group(0).lower()]
+
+    return [
+        (score, para)
+        for score, para in zip(scores, paragraphs, strict=True)
+        if score > 0 and len(para.strip()) >= 50
+    ]
+
+
+# Keyword topics recognised in crawled content (simple keyword extraction).
+# You could replace this with an LLM-based extraction for better results
+TOPICS = (
+    "api", "sdk", "authentication", "authorization", "database", "deployment", "configuration",
+    "tutorial", "guide", "documentation", "example", "reference", "endpoint", "webhook",
+    "integration", "security", "performance", "optimization", "testing", "debugging",
+)
+TOPIC_RE = re.compile(rf"\b({'|'.join(TOPICS)})\b", re.IGNORECASE)
+LINK_RE = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+')
+# Netloc of a LINK_RE match, as urlsplit would return it
+NETLOC_RE = re.compile(r'https?://([^/?#]*)')
+
+_topic_db: Optional[Any] = None
+_topic_automaton: Optional[Any] = None
+
+
+def get_topic_db() -> Optional[Any]:
+    """Compile the topic keywords into one Hyperscan database (once per process)."""
+    global _topic_db
+    if _topic_db is None and HYPERSCAN_AVAILABLE:
+        # Hyperscan has no \b in UTF-8/UCP mode, so word boundaries are
+        # checked by find_topics around each (leftmost-start) match
+        flags = (
+            hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST
+            | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+        )
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[topic.encode() for topic in TOPICS],
+            ids=list(range(len(TOPICS))),
+            elements=len(TOPICS),
+            flags=[flags] * len(TOPICS),
+        )
+        _topic_db = db
+    return _topic_db
+
+
+def get_topic_automaton() -> Optional[Any]:
+    """Build the Aho-Corasick automaton over the topic keywords (once per process)."""
+    global _topic_automaton
+    if _topic_automaton is None and AHOCORASICK_AVAILABLE:
+        automaton = ahocorasick.Automaton()
+        for topic in TOPICS:
+            automaton.add_word(topic, topic)
+        automaton.make_automaton()
+        _topic_automaton = automaton
+    return _topic_automaton
+
+
+def _find_topics_automaton(automaton: Any, content_lower: str) -> Set[str]:
+    found: Set[str] = set()
+    last = len(content_lower) - 1
+    for end, topic in automaton.iter(content_lower):
+        if topic in found:
+            continue
+        start = end - len(topic) + 1
+        if start > 0 and _is_word_char(content_lower[start - 1]):
+            continue
+        if end < last and _is_word_char(content_lower[end + 1]):
+            continue
+        found.add(topic)
+        if len(found) == len(TOPICS):
+            break
+    return found
+
+
+def find_topics(content: str) -> Set[str]:
+    """
+    Return the (lowercase) topic keywords that occur in content as whole words.
+    Uses Hyperscan, then Aho-Corasick, when installed; TOPIC_RE otherwise.
+    """
+    db = get_topic_db()
+    if db is None:
+        automaton = get_topic_automaton()
+        if automaton is not None:
+            content_lower = content.lower()
+            # Word boundaries are checked on the lowered text, which is only
+            # valid when lowering preserved character offsets
+            if len(content_lower) == len(content):
+                return _find_topics_automaton(automaton, content_lower)
+        # Scanned as str on purpose: ASCII pages are already 1 byte/char, and a
+        # bytes-mode \b would treat non-ASCII letters (é) as word boundaries
+        return {match.lower() for match in TOPIC_RE.findall(content)}
+
+    data = content.encode("utf-8")
+    found: Set[str] = set()
+
+    def on_match(topic_id: int, start: int, end: int, flags: int, context: Any) -> Optional[bool]:
+        topic = TOPICS[topic_id]
+        if topic in found:
+            return None
+        # Offsets are in bytes; a UTF-8 character is at most 4 bytes long
+        before = data[max(0, start - 4):start].decode("utf-8", errors="ignore")[-1:]
+        after = data[end:end + 4].decode("utf-8", errors="ignore")[:1]
+        if not _is_word_char(before) and not _is_word_char(after):
+            found.add(topic)
+        # Stop scanning once every topic has been seen
+        return len(found) == len(TOPICS) or None
+
+    db.scan(data, match_event_handler=on_match)
+    return found
+
+
+@dataclass
+class GraphRows:
+    """
+    Knowledge-graph rows for one page, kept as plain columns.
+
+    write_graph_rows passes the lists straight to UNWIND queries; entity and
+    relation dicts are only built by extract_entities_and_relations.
+    """
+    url: str
+    title: str
+    domain: str
+    crawled_at: str
+    topics: List[str] = field(default_factory=list)  # Title-cased topic names
+    links: List[str] = field(default_factory=list)  # Links to pages on other domains
+
+
+def extract_graph_rows(
+    url: str,
+    title: str,
+    content: str,
+    crawled_at: Optional[str] = None
+) -> GraphRows:
+    """Extract the page, its domain, topics and outgoing links for the knowledge graph."""
+    # Parse URL for domain entity
+    domain = urlsplit(url).netloc
+
+    # Extract topics from content
+    topics = [topic.title() for topic in find_topics(content)]
+
+    # Extract links to other domains, each once (nav bars and footers repeat
+    # them); stop scanning at the first 20 instead of collecting every URL
+    links: List[str] = []
+    seen: Set[str] = set()
+    for match in LINK_RE.finditer(content):
+        link = match.group(0)
+        if link in seen:
+            continue
+        seen.add(link)
+        netloc = NETLOC_RE.match(link)  # Always matches: LINK_RE hits start with a scheme
+        if netloc is not None and netloc.group(1) not in ("", domain):
+            links.append(link)
+            if len(links) == 20:  # Limit to first 20 links
+                break
+
+    return GraphRows(
+        url=url,
+        title=title or url,
+        domain=domain,
+        crawled_at=crawled_at or utc_now_iso(),
+        topics=topics,
+        links=links,
+    )
 
 
 def extract_entities_and_relations(
     url: str,
     title: str,
-    content: str
+    content: str,
+    crawled_at: Optional[str] = None
 ) -> Tuple[List[Dict], List[Dict]]:
     """
     Extract entities and relationships from content for knowledge graph.
     Returns (entities, relations) tuples.
     """
-    entities = []
-    relations = []
-
-    # Parse URL for domain entity
-    parsed = urlparse(url)
-    domain = parsed.netloc
-
-    # Create page entity
-    page_entity = {
-        "type": "WebPage",
-        "url": url,
-        "title": title or url,
-        "domain": domain,
-        "crawled_at": datetime.utcnow().isoformat()
-    }
-    entities.append(page_entity)
-
-    # Create domain entity
-    domain_entity = {
-        "type": "Domain",
-        "name": domain
-    }
-    entities.append(domain_entity)
-
-    # Relation: Page BELONGS_TO Domain
-    relations.append({
+    rows = extract_graph_rows(url, title, content, crawled_at)
+
+    entities: List[Dict] = [
+        {
+            "type": "WebPage",
+            "url": rows.url,
+            "title": rows.title,
+            "domain": rows.domain,
+            "crawled_at": rows.crawled_at
+        },
+        {"type": "Domain", "name": rows.domain},
+    ]
+    relations: List[Dict] = [{
         "from_type": "WebPage",
         "from_id": url,
         "to_type": "Domain",
-        "to_id": domain,
+        "to_id": rows.domain,
         "relation": "BELONGS_TO"
-    })
-
-    # Extract topics from content (simple keyword extraction)
-    # You could replace this with an LLM-based extraction for better results
-    topic_patterns = [
-        r'(?i)\b(api|sdk|authentication|authorization|database|deployment|configuration|'
-        r'tutorial|guide|documentation|example|reference|endpoint|webhook|'
-        r'integration|security|performance|optimization|testing|debugging)\b'
-    ]
-
-    topics_found = set()
-    for pattern in topic_patterns:
-        matches = re.findall(pattern, content.lower())
-        topics_found.update(matches)
-
-    for topic in topics_found:
-        topic_entity = {
-            "type": "Topic",
-            "name": topic.title()
-        }
-        entities.append(topic_entity)
+    }]
 
+    for topic in rows.topics:
+        entities.append({"type": "Topic", "name": topic})
         relations.append({
             "from_type": "WebPage",
             "from_id": url,
             "to_type": "Topic",
-            "to_id": topic.title(),
+            "to_id": topic,
             "relation": "COVERS_TOPIC"
         })
 
-    # Extract links as relations
-    link_pattern = r'https?://[^\s<>"{}|\\^`\[\]]+'
-    links = re.findall(link_pattern, content)
-
-    for link in links[:20]:  # Limit to first 20 links
-        link_parsed = urlparse(link)
-        if link_parsed.netloc and link_parsed.netloc != domain:
-            relations.append({
-                "from_type": "WebPage",
-                "from_id": url,
-                "to_type": "WebPage",
-                "to_id": link,
-                "relation": "LINKS_TO"
-            })
+    for link in rows.links:
+        relations.append({
+            "from_type": "WebPage",
+            "from_id": url,
+            "to_type": "WebPage",
+            "to_id": link,
+            "relation": "LINKS_TO"
+        })
 
     return entities, relations
 
 
+# Longest text sent to a single embedding request (query embeddings)
+EMBEDDING_INPUT_CHARS = 8000
+
+
+def normalize_embedding(embedding: List[float]) -> List[float]:
+    """
+    Scale an embedding to unit length.
+    Stored and query vectors are both unit-length, so match_documents can rank
+    by inner product instead of cosine distance.
+    """
+    norm = math.sqrt(math.fsum(x * x for x in embedding))
+    if norm == 0.0 or abs(norm - 1.0) < 1e-6:
+        return embedding
+    return [x / norm for x in embedding]
+
+
+def _is_retryable_embedding_error(error: BaseException) -> bool:
+    """Rate limits, 5xx responses and connection errors / timeouts are worth retrying."""
+    return AZURE_OPENAI_AVAILABLE and isinstance(
+        error, (RateLimitError, InternalServerError, APIConnectionError)
+    )
+
+
+def _retry_delay(error: BaseException, attempt: int) -> float:
+    """Honour Retry-After when the service sends it, else exponential backoff with jitter."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return min(60.0, float(retry_after))
+        except ValueError:
+            pass
+    return min(30.0, 2.0 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def create_embeddings(client: Any, inputs: List[str]) -> Any:
+    """
+    Call the embeddings API for a list of inputs.
+    At most EMBEDDING_MAX_CONCURRENCY requests are in flight; retryable
+    failures are retried up to EMBEDDING_MAX_RETRIES times with backoff.
+    """
+    attempt = 0
+    while True:
+        try:
+            async with _embedding_semaphore:
+                return await client.embeddings.create(
+                    model=AZURE_EMBEDDING_DEPLOYMENT,
+                    input=inputs
+                )
+        except Exception as e:
+            if attempt >= EMBEDDING_MAX_RETRIES or not _is_retryable_embedding_error(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            attempt += 1
+            logger.warning(
+                "Embeddings request failed (%s); retry %d/%d in %.1fs",
+                e, attempt, EMBEDDING_MAX_RETRIES, delay
+            )
+            # Sleep outside the semaphore so other requests can proceed
+            await asyncio.sleep(delay)
+
+
 async def generate_embedding(text: str) -> Optional[List[float]]:
-    """Generate embedding using Azure OpenAI."""
+    """Generate embedding using Azure OpenAI, reusing cached embeddings of the same text."""
     client = get_azure_openai()
     if not client:
         return None
 
+    if len(text) > EMBEDDING_INPUT_CHARS:
+        text = text[:EMBEDDING_INPUT_CHARS]
+    sha = content_sha256(text)
+    cached = await get_cached_embeddings([sha])
+    if sha in cached:
+        return cached[sha]
+
     try:
-        response = client.embeddings.create(
-            model=AZURE_EMBEDDING_DEPLOYMENT,
-            input=text[:8000]  # Limit input for embedding
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Failed to generate embedding: {e}")
+        response = await create_embeddings(client, [text])
+        embedding = normalize_embedding(response.data[0].embedding)
+    except Exception:
+        logger.exception("Failed to generate embedding")
         return None
 
+    await remember_embeddings([(sha, embedding)])
+    return embedding
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a search query: case and whitespace do not change the match."""
+    return " ".join(query.split()).lower()
+
+
+async def get_query_embedding(
+    query: str,
+    on_miss: Optional[Callable[[], Any]] = None
+) -> Optional[List[float]]:
+    """
+    Embed a search query through a TTL'd LRU keyed by the normalized query.
+    Only the key is normalized; the model sees the query as the user typed it.
+    On a cache miss, the blocking on_miss callable runs in a thread while the
+    embeddings call is in flight.
+    """
+    key = normalize_query(query)
+    embedding: Optional[List[float]] = _query_embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+
+    if on_miss is None:
+        embedding = await generate_embedding(query)
+    else:
+        embedding, _ = await asyncio.gather(generate_embedding(query), asyncio.to_thread(on_miss))
+    if embedding is not None:
+        _query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+# Rows per Supabase upsert request (keeps PostgREST payloads bounded)
+SUPABASE_UPSERT_CHUNK = 500
+# Hashes per content_sha256 lookup (keeps the GET query string bounded)
+SUPABASE_LOOKUP_CHUNK = 100
+# Search results are capped (also enforced in match_documents) and only a
+# preview of each chunk's content is sent back from Postgres
+SEARCH_MAX_RESULTS = 50
+SEARCH_PREVIEW_CHARS = 2000
+
+
+def _estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token) used for batch packing."""
+    return max(1, len(text) // 4)
+
+
+def content_sha256(content: str) -> str:
+    """Hash the exact text that gets embedded, used as the embedding cache key."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def cache_embedding(sha: str, embedding: List[float]) -> None:
+    """Remember an embedding in the in-process LRU."""
+    _embedding_cache[sha] = embedding
+    _embedding_cache.move_to_end(sha)
+    while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+
+
+class EmbeddingDiskCache:
+    """
+    Persistent embedding cache in a local sqlite file.
+
+    Rows are keyed on (model, content hash), so changing the embedding
+    deployment never serves vectors from another model. Embeddings are
+    stored as packed float32 blobs. Calls are blocking; run them off the
+    event loop.
+    """
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.model = model
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(Path(self.path).expanduser()), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS emb_cache ("
+                " model TEXT NOT NULL,"
+                " sha256 TEXT NOT NULL,"
+                " embedding BLOB NOT NULL,"
+                " PRIMARY KEY (model, sha256)"
+                ") WITHOUT ROWID"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Return the cached embeddings for whichever hashes are present."""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            conn = self._connect()
+            # Stay well under sqlite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = conn.execute(
+                    "SELECT sha256, embedding FROM emb_cache WHERE model = ? AND sha256 IN "
+                    f"({','.join('?' * len(chunk))})",
+                    [self.model, *chunk]
+                )
+                for sha, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[sha] = vector.tolist()
+        return found
+
+    def put_many(self, pairs: List[Tuple[str, List[float]]]) -> None:
+        """Store (hash, embedding) pairs, replacing existing rows."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO emb_cache (model, sha256, embedding) VALUES (?, ?, ?)",
+                    [(self.model, sha, array("f", embedding).tobytes()) for sha, embedding in pairs]
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def get_embedding_disk_cache() -> Optional[EmbeddingDiskCache]:
+    """Get the on-disk embedding cache when EMBEDDING_CACHE_PATH is set."""
+    global _embedding_disk_cache
+    if _embedding_disk_cache is None and EMBEDDING_CACHE_PATH:
+        _embedding_disk_cache = EmbeddingDiskCache(EMBEDDING_CACHE_PATH, AZURE_EMBEDDING_DEPLOYMENT)
+    return _embedding_disk_cache
+
+
+async def get_cached_embeddings(hashes: List[str]) -> Dict[str, List[float]]:
+    """Look hashes up in the in-process LRU, then in the on-disk cache."""
+    embeddings: Dict[str, List[float]] = {}
+    for sha in hashes:
+        if sha in _embedding_cache:
+            _embedding_cache.move_to_end(sha)
+            embeddings[sha] = _embedding_cache[sha]
+
+    disk_cache = get_embedding_disk_cache()
+    missing = [sha for sha in dict.fromkeys(hashes) if sha not in embeddings]
+    if disk_cache and missing:
+        try:
+            for sha, embedding in (await asyncio.to_thread(disk_cache.get_many, missing)).items():
+                cache_embedding(sha, embedding)
+                embeddings[sha] = embedding
+        except Exception:
+            logger.exception("Failed to read embedding cache")
+    return embeddings
+
+
+async def remember_embeddings(pairs: List[Tuple[str, List[float]]]) -> None:
+    """Add freshly fetched embeddings to the in-process LRU and the on-disk cache."""
+    for sha, embedding in pairs:
+        cache_embedding(sha, embedding)
+
+    disk_cache = get_embedding_disk_cache()
+    if disk_cache and pairs:
+        try:
+            await asyncio.to_thread(disk_cache.put_many, pairs)
+        except Exception:
+            logger.exception("Failed to write embedding cache")
+
+
+async def lookup_stored_embeddings(hashes: List[str]) -> Dict[str, List[float]]:
+    """Fetch embeddings already stored in Supabase for the given content hashes."""
+    supabase = get_supabase()
+    if not supabase or not hashes:
+        return {}
+
+    found: Dict[str, List[float]] = {}
+    try:
+        for start in range(0, len(hashes), SUPABASE_LOOKUP_CHUNK):
+            chunk = hashes[start:start + SUPABASE_LOOKUP_CHUNK]
+            query = (
+                supabase.table("crawled_content")
+                .select("content_sha256, embedding")
+                .in_("content_sha256", chunk)
+            )
+            response = await asyncio.to_thread(query.execute)
+            for row in response.data or []:
+                embedding = row.get("embedding")
+                # pgvector columns come back from PostgREST as '[0.1,0.2,...]'
+                if isinstance(embedding, str):
+                    embedding = json_loads(embedding)
+                if embedding:
+                    found[row["content_sha256"]] = embedding
+    except Exception:
+        logger.exception("Failed to look up cached embeddings")
+    return found
+
+
+async def bulk_upsert(rows: List[Dict[str, Any]]) -> bool:
+    """Upsert rows into crawled_content in as few requests as possible."""
+    supabase = get_supabase()
+    if not supabase or not rows:
+        return False
+
+    try:
+        for start in range(0, len(rows), SUPABASE_UPSERT_CHUNK):
+            chunk = rows[start:start + SUPABASE_UPSERT_CHUNK]
+            query = supabase.table("crawled_content").upsert(chunk, on_conflict="url,chunk_index")
+            await asyncio.to_thread(query.execute)
+        return True
+    except Exception:
+        logger.exception("Failed to upsert %d rows in vector DB", len(rows))
+        return False
+
+
+async def prune_stale_chunks(chunk_counts: Dict[str, int]) -> None:
+    """Delete chunks left over from earlier, longer versions of the given pages."""
+    supabase = get_supabase()
+    if not supabase or not chunk_counts:
+        return
+
+    try:
+        query = supabase.rpc("prune_crawled_chunks", {
+            "p_urls": list(chunk_counts),
+            "p_chunk_counts": list(chunk_counts.values())
+        })
+        await asyncio.to_thread(query.execute)
+    except Exception:
+        logger.exception("Failed to prune stale chunks")
+
+
+# Pages collected into one flush before it starts, however fast they arrive
+EMBEDDING_BATCH_MAX_PAGES = 500
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent vector DB writes into batched API calls.
+
+    Requests submitted within `window` seconds of each other are flushed
+    together: each page is split into chunks, pages are packed into
+    embeddings.create calls of at most `token_budget` estimated tokens and
+    `batch_size` inputs (a page over those limits is split across calls),
+    and all resulting chunk rows are written with a single bulk upsert. If
+    a batched request fails, its pages are retried one request each so a
+    single bad page does not sink the whole batch.
+    """
+
+    def __init__(
+        self,
+        window: float = EMBEDDING_BATCH_WINDOW,
+        token_budget: int = EMBEDDING_BATCH_TOKENS,
+        batch_size: int = EMBEDDING_BATCH_SIZE
+    ):
+        self.window = window
+        self.token_budget = token_budget
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self) -> asyncio.Queue:
+        """Start the background flusher lazily on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._queue is None:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._flusher_task = None
+        queue = self._queue
+        if self._flusher_task is None or self._flusher_task.done():
+            self._flusher_task = loop.create_task(self._flusher(queue))
+        return queue
+
+    def submit(
+        self,
+        url: str,
+        content: str,
+        title: Optional[str] = None,
+        crawled_at: Optional[str] = None
+    ) -> "asyncio.Future[bool]":
+        """Queue a page for embedding + storage. The future resolves to True if stored."""
+        future: "asyncio.Future[bool]" = asyncio.get_running_loop().create_future()
+        if not content.strip():
+            future.set_result(False)
+            return future
+        self._ensure_started().put_nowait((url, content, title, crawled_at, future))
+        return future
+
+    async def close(self) -> None:
+        """Flush pending requests and stop the background flusher."""
+        if self._flusher_task is None or self._flusher_task.done() or self._queue is None:
+            return
+        if self._loop is not asyncio.get_running_loop():
+            return
+        self._queue.put_nowait(None)
+        await self._flusher_task
+        self._flusher_task = None
+
+    async def _flusher(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            first = await queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            deadline = loop.time() + self.window
+
+            while len(batch) < EMBEDDING_BATCH_MAX_PAGES:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    def _split(self, job: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+        """
+        Cut one page's chunks into consecutive pieces that each fit the token
+        budget and batch size. A chunk over the budget on its own goes alone.
+        """
+        pieces: List[List[Tuple[str, str]]] = []
+        current: List[Tuple[str, str]] = []
+        tokens = 0
+        for pair in job:
+            pair_tokens = _estimate_tokens(pair[1])
+            if current and (
+                tokens + pair_tokens > self.token_budget
+                or len(current) >= self.batch_size
+            ):
+                pieces.append(current)
+                current, tokens = [], 0
+            current.append(pair)
+            tokens += pair_tokens
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _pack(self, jobs: List[List[Tuple[str, str]]]) -> List[list]:
+        """
+        Split per-page embedding jobs into requests that fit the token budget
+        and batch size. A page's chunks travel in the same request unless the
+        page alone is over the limits, in which case it is split first.
+        """
+        groups: List[list] = []
+        current: list = []
+        tokens = 0
+        inputs = 0
+        for piece in (p for page in jobs for p in self._split(page)):
+            piece_tokens = sum(_estimate_tokens(chunk) for _, chunk in piece)
+            if current and (
+                tokens + piece_tokens > self.token_budget
+                or inputs + len(piece) > self.batch_size
+            ):
+                groups.append(current)
+                current, tokens, inputs = [], 0, 0
+            current.append(piece)
+            tokens += piece_tokens
+            inputs += len(piece)
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _resolve_cached(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Return known embeddings for the hashes: memory, then disk, then Supabase."""
+        embeddings = await get_cached_embeddings(hashes)
+
+        missing = [sha for sha in dict.fromkeys(hashes) if sha not in embeddings]
+        stored = await lookup_stored_embeddings(missing)
+        await remember_embeddings(list(stored.items()))
+        embeddings.update(stored)
+        return embeddings
+
+    async def _flush(
+        self,
+        batch: List[Tuple[str, str, Optional[str], Optional[str], asyncio.Future]]
+    ) -> None:
+        """Embed and store a batch; every caller's future is resolved, even on errors."""
+        stored: Set[int] = set()
+        try:
+            stored = await self._embed_and_store(batch)
+        except Exception:
+            logger.error("Failed to store %d pages in vector DB", len(batch), exc_info=True)
+        finally:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_result(id(future) in stored)
+
+    async def _embed_and_store(
+        self,
+        batch: List[Tuple[str, str, Optional[str], Optional[str], asyncio.Future]]
+    ) -> Set[int]:
+        """Returns the ids of the futures whose pages were stored."""
+        client = get_azure_openai()
+        page_chunks = [chunk_content(item[1]) for item in batch]
+        page_hashes = [[content_sha256(chunk) for chunk in chunks] for chunks in page_chunks]
+        embeddings = await self._resolve_cached([sha for shas in page_hashes for sha in shas])
+
+        # Only embed chunks we have never seen, once per distinct hash
+        jobs: List[List[Tuple[str, str]]] = []
+        queued = set()
+        for chunks, shas in zip(page_chunks, page_hashes, strict=True):
+            job = []
+            for sha, chunk in zip(shas, chunks, strict=True):
+                if sha not in embeddings and sha not in queued:
+                    queued.add(sha)
+                    job.append((sha, chunk))
+            if job:
+                jobs.append(job)
+        groups = self._pack(jobs)
+
+        async def embed_group(group: list) -> List[Tuple[str, List[float]]]:
+            if not client:
+                raise RuntimeError("Azure OpenAI client not available")
+            pairs = [pair for job in group for pair in job]
+            response = await create_embeddings(client, [chunk for _, chunk in pairs])
+            ordered = sorted(response.data, key=lambda d: d.index)
+            return [(sha, normalize_embedding(d.embedding)) for (sha, _), d in zip(pairs, ordered, strict=True)]
+
+        async def embed_with_fallback(group: list) -> List[Tuple[str, List[float]]]:
+            try:
+                return await embed_group(group)
+            except Exception as e:
+                if len(group) == 1:
+                    raise
+                logger.warning(
+                    "Batched embedding request failed (%s); retrying %d pages individually",
+                    e, len(group)
+                )
+
+            pairs: List[Tuple[str, List[float]]] = []
+            retries = await asyncio.gather(
+                *(embed_group([job]) for job in group),
+                return_exceptions=True
+            )
+            for outcome in retries:
+                if isinstance(outcome, BaseException):
+                    logger.error("Failed to generate embeddings for 1 page", exc_info=outcome)
+                else:
+                    pairs.extend(outcome)
+            return pairs
+
+        outcomes = await asyncio.gather(
+            *(embed_with_fallback(group) for group in groups),
+            return_exceptions=True
+        )
+
+        fresh: List[Tuple[str, List[float]]] = []
+        for group, outcome in zip(groups, outcomes, strict=True):
+            if isinstance(outcome, BaseException):
+                logger.error("Failed to generate embeddings for %d pages", len(group), exc_info=outcome)
+                continue
+            fresh.extend(outcome)
+        await remember_embeddings(fresh)
+        embeddings.update(fresh)
+
+        # One set of chunk rows per URL - Postgres rejects an upsert touching the same row twice
+        flushed_at = utc_now_iso()
+        pages: Dict[str, List[Dict[str, Any]]] = {}
+        embedded = set()
+        for (url, _, title, crawled_at, future), chunks, shas in zip(batch, page_chunks, page_hashes, strict=True):
+            if not chunks or any(sha not in embeddings for sha in shas):
+                continue
+            pages[url] = [
+                {
+                    "url": url,
+                    "chunk_index": index,
+                    "title": title,
+                    "content": chunk,
+                    "content_sha256": sha,
+                    "embedding": embeddings[sha],
+                    "crawled_at": crawled_at or flushed_at
+                }
+                for index, (chunk, sha) in enumerate(zip(chunks, shas, strict=True))
+            ]
+            embedded.add(id(future))
+
+        rows = [row for page_rows in pages.values() for row in page_rows]
+        if not rows or not await bulk_upsert(rows):
+            return set()
+        await prune_stale_chunks({url: len(page_rows) for url, page_rows in pages.items()})
+        return embedded
+
+
+def run_in_background(coro: Coroutine[Any, Any, Any], description: str) -> asyncio.Task:
+    """
+    Run a coroutine without blocking the caller.
+    Tasks are tracked so they are not garbage collected and can be awaited on shutdown.
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+
+    def _done(t: asyncio.Task) -> None:
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("Background task failed (%s)", description, exc_info=t.exception())
+
+    task.add_done_callback(_done)
+    return task
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Get or create the global embedding batcher."""
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        _embedding_batcher = EmbeddingBatcher()
+    return _embedding_batcher
+
+
+def is_boilerplate(url: str, content: str) -> bool:
+    """
+    Once this exact page body has been stored for BOILERPLATE_URL_THRESHOLD
+    other URLs, further copies are boilerplate.
+    """
+    sha = content_sha256(content)
+    urls = _page_hash_urls.get(sha)
+    if urls is None:
+        return False
+    _page_hash_urls.move_to_end(sha)
+    if url in urls:
+        return False  # Re-crawl of a URL we already stored
+    return len(urls) >= BOILERPLATE_URL_THRESHOLD
+
+
+def remember_page_url(url: str, content: str) -> None:
+    """Record that url's body was stored; only successful stores count toward is_boilerplate."""
+    sha = content_sha256(content)
+    _page_hash_urls.setdefault(sha, set()).add(url)
+    _page_hash_urls.move_to_end(sha)
+    while len(_page_hash_urls) > EMBEDDING_CACHE_SIZE:
+        _page_hash_urls.popitem(last=False)
+
 
 async def store_in_vector_db(
     url: str,
     content: str,
-    title: Optional[str] = None
+    title: Optional[str] = None,
+    crawled_at: Optional[str] = None
 ) -> bool:
-    """Store crawled content in Supabase vector database."""
+    """
+    Store crawled content in Supabase vector database, one row per chunk.
+    crawled_at defaults to the time the batch is written.
+    Writes are coalesced by the embedding batcher, so concurrent calls share
+    batched embeddings requests and a single bulk upsert. Content whose hash
+    already has an embedding (in memory or in Supabase) is not re-embedded;
+    near-empty pages and boilerplate are skipped (returns False).
+    """
     if not RAG_AVAILABLE:
         return False
 
+    # Nav stubs, empty pages and repeated boilerplate add nothing to retrieval
+    if len(content.strip()) < EMBEDDING_MIN_CHARS or is_boilerplate(url, content):
+        return False
+
     supabase = get_supabase()
     if not supabase:
         return False
 
+    stored = await get_embedding_batcher().submit(url, content, title, crawled_at)
+    if stored:
+        remember_page_url(url, content)
+    return stored
+
+
+# Pages per Neo4j write transaction when crawl_multiple_pages stores a batch
+GRAPH_WRITE_CHUNK = 50
+
+
+async def write_graph_rows(tx: Any, pages: List[GraphRows]) -> None:
+    """Write the pages' nodes, domains, topics and links in one transaction."""
+    params = [asdict(rows) for rows in pages]
+
+    await tx.run("""
+        UNWIND $pages AS page
+        MERGE (p:WebPage {url: page.url})
+        SET p.title = page.title, p.domain = page.domain, p.crawled_at = page.crawled_at
+        MERGE (d:Domain {name: page.domain})
+        MERGE (p)-[:BELONGS_TO]->(d)
+    """, pages=params)
+
+    if any(rows.topics for rows in pages):
+        await tx.run("""
+            UNWIND $pages AS page
+            MATCH (p:WebPage {url: page.url})
+            UNWIND page.topics AS name
+            MERGE (t:Topic {name: name})
+            MERGE (p)-[:COVERS_TOPIC]->(t)
+        """, pages=params)
+
+    if any(rows.links for rows in pages):
+        await tx.run("""
+            UNWIND $pages AS page
+            MATCH (p1:WebPage {url: page.url})
+            UNWIND page.links AS link
+            MERGE (p2:WebPage {url: link})
+            MERGE (p1)-[:LINKS_TO]->(p2)
+        """, pages=params)
+
+
+async def store_pages_in_graph_db(
+    pages: List[Tuple[str, str, Optional[str], Optional[str]]]
+) -> int:
+    """
+    Store (url, content, title, crawled_at) pages in the Neo4j knowledge graph,
+    one transaction (three UNWIND queries) for the whole list.
+    Returns the number of pages stored: all of them, or 0 if the write failed.
+    """
+    if not GRAPH_RAG_AVAILABLE or not pages:
+        return 0
+
+    driver = get_neo4j_driver()
+    if not driver:
+        return 0
+
     try:
-        embedding = await generate_embedding(content)
-        if not embedding:
-            return False
+        rows = [
+            extract_graph_rows(url, title or "", content, crawled_at)
+            for url, content, title, crawled_at in pages
+        ]
 
-        # Store in Supabase
-        supabase.table("crawled_content").upsert({
-            "url": url,
-            "title": title,
-            "content": content,
-            "embedding": embedding,
-            "crawled_at": datetime.utcnow().isoformat()
-        }).execute()
+        async with driver.session() as session:
+            await session.execute_write(write_graph_rows, rows)
 
-        return True
-    except Exception as e:
-        print(f"Failed to store in vector DB: {e}")
-        return False
+        return len(rows)
+    except Exception:
+        logger.exception("Failed to store in graph DB")
+        return 0
 
 
 async def store_in_graph_db(
     url: str,
     content: str,
-    title: Optional[str] = None
+    title: Optional[str] = None,
+    crawled_at: Optional[str] = None
 ) -> bool:
-    """Store crawled content in Neo4j knowledge graph."""
-    if not GRAPH_RAG_AVAILABLE:
-        return False
+    """
+    Store crawled content in Neo4j knowledge graph.
 
-    driver = get_neo4j_driver()
-    if not driver:
-        return False
+    crawled_at defaults to now; pass the tool's timestamp so the graph node
+    and the vector rows agree.
+    """
+    return await store_pages_in_graph_db([(url, content, title, crawled_at)]) == 1
 
-    try:
-        entities, relations = extract_entities_and_relations(url, title or "", content)
-
-        with driver.session() as session:
-            # Create entities
-            for entity in entities:
-                if entity["type"] == "WebPage":
-                    session.run("""
-                        MERGE (p:WebPage {url: $url})
-                        SET p.title = $title, p.domain = $domain, p.crawled_at = $crawled_at
-                    """, url=entity["url"], title=entity["title"],
-                        domain=entity["domain"], crawled_at=entity["crawled_at"])
-
-                elif entity["type"] == "Domain":
-                    session.run("""
-                        MERGE (d:Domain {name: $name})
-                    """, name=entity["name"])
-
-                elif entity["type"] == "Topic":
-                    session.run("""
-                        MERGE (t:Topic {name: $name})
-                    """, name=entity["name"])
-
-            # Create relations
-            for rel in relations:
-                if rel["relation"] == "BELONGS_TO":
-                    session.run("""
-                        MATCH (p:WebPage {url: $from_id})
-                        MATCH (d:Domain {name: $to_id})
-                        MERGE (p)-[:BELONGS_TO]->(d)
-                    """, from_id=rel["from_id"], to_id=rel["to_id"])
-
-                elif rel["relation"] == "COVERS_TOPIC":
-                    session.run("""
-                        MATCH (p:WebPage {url: $from_id})
-                        MATCH (t:Topic {name: $to_id})
-                        MERGE (p)-[:COVERS_TOPIC]->(t)
-                    """, from_id=rel["from_id"], to_id=rel["to_id"])
-
-                elif rel["relation"] == "LINKS_TO":
-                    session.run("""
-                        MATCH (p1:WebPage {url: $from_id})
-                        MERGE (p2:WebPage {url: $to_id})
-                        MERGE (p1)-[:LINKS_TO]->(p2)
-                    """, from_id=rel["from_id"], to_id=rel["to_id"])
 
-        return True
-    except Exception as e:
-        print(f"Failed to store in graph DB: {e}")
+async def store_all(
+    url: str,
+    content: str,
+    title: Optional[str] = None,
+    crawled_at: Optional[str] = None,
+    store_in_db: bool = True,
+    store_in_graph: bool = True
+) -> Tuple[bool, bool]:
+    """
+    Store a page in the vector DB and the knowledge graph concurrently.
+    Returns (stored_in_db, stored_in_graph); skipped stores report False.
+    """
+    crawled_at = crawled_at or utc_now_iso()
+
+    async def skipped() -> bool:
         return False
 
+    stored_vector, stored_graph = await asyncio.gather(
+        store_in_vector_db(url, content, title, crawled_at=crawled_at) if store_in_db else skipped(),
+        store_in_graph_db(url, content, title, crawled_at=crawled_at) if store_in_graph else skipped(),
+    )
+    return stored_vector, stored_graph
+
 
 # =============================================================================
 # MCP Tools
@@ -440,7 +1692,8 @@ async def crawl_single_page(
     include_links: bool = True,
     wait_for: Optional[str] = None,
     store_in_db: bool = False,
-    store_in_graph: bool = False
+    store_in_graph: bool = False,
+    force_refresh: bool = False
 ) -> str:
     """
     Crawl a single URL and extract content as clean markdown.
@@ -450,8 +1703,9 @@ async def crawl_single_page(
         include_images: Include image descriptions in output
         include_links: Include links in output
         wait_for: CSS selector to wait for before extraction
-        store_in_db: Store in Supabase vector DB for RAG (default: False)
+        store_in_db: Store in Supabase vector DB for RAG, in the background (default: False)
         store_in_graph: Store in Neo4j knowledge graph (default: False)
+        force_refresh: Load the page even if it was crawled in the last PAGE_CACHE_TTL seconds
 
     Returns:
         Markdown content extracted from the page
@@ -465,72 +1719,73 @@ async def crawl_single_page(
             mean_delay=MEAN_DELAY,
         )
 
-        result = await crawler.arun(url=url, config=config)
+        result = await fetch_page(crawler, url, config, force_refresh)
 
         if not result.success:
             return f"Error crawling {url}: {result.error_message}"
 
         # Build response
-        output_parts = []
+        buf = io.StringIO()
+        write = buf.write
         title = result.metadata.get("title")
 
         if title:
-            output_parts.append(f"# {title}\n")
+            write(f"# {title}\n")
 
-        output_parts.append(f"**Source:** {url}\n")
-        output_parts.append(f"**Crawled:** {datetime.utcnow().isoformat()}\n")
+        crawled_at = utc_now_iso()
+        write(f"**Source:** {url}\n**Crawled:** {crawled_at}\n")
 
         # Add main content (markdown)
         content = result.markdown or result.cleaned_html or ""
 
         # Storage status
-        stored_vector = False
         stored_graph = False
 
         if store_in_db:
-            stored_vector = await store_in_vector_db(url, content, title)
-            output_parts.append(f"**Stored in Vector DB:** {'✓ Yes' if stored_vector else '✗ No (check configuration)'}\n")
+            if RAG_AVAILABLE:
+                # Embedding + upsert happen off the response path
+                run_in_background(
+                    store_in_vector_db(url, content, title, crawled_at=crawled_at),
+                    f"vector store {url}"
+                )
+                write("**Stored in Vector DB:** ⏳ Queued (embedding in background)\n")
+            else:
+                write("**Stored in Vector DB:** ✗ No (check configuration)\n")
 
         if store_in_graph:
-            stored_graph = await store_in_graph_db(url, content, title)
-            output_parts.append(f"**Stored in Graph DB:** {'✓ Yes' if stored_graph else '✗ No (check configuration)'}\n")
+            stored_graph = await store_in_graph_db(url, content, title, crawled_at=crawled_at)
+            write(f"**Stored in Graph DB:** {'✓ Yes' if stored_graph else '✗ No (check configuration)'}\n")
 
-        output_parts.append("---\n")
-        output_parts.append(truncate_content(content))
+        write("---\n")
+        write_truncated(write, content)
 
         # Add links if requested
         if include_links and result.links:
-            internal_links = result.links.get("internal", [])[:20]
-            external_links = result.links.get("external", [])[:10]
+            internal_links = first_unique(result.links.get("internal", []), "href", 20)
+            external_links = first_unique(result.links.get("external", []), "href", 10)
 
             if internal_links or external_links:
-                output_parts.append("\n\n---\n## Links\n")
+                write("\n\n---\n## Links\n")
 
                 if internal_links:
-                    output_parts.append("\n### Internal Links\n")
-                    for link in internal_links:
-                        href = link.get("href", "")
-                        text = link.get("text", href)[:50]
-                        output_parts.append(f"- [{text}]({href})\n")
+                    write("\n### Internal Links\n")
+                    write(format_links(internal_links))
 
                 if external_links:
-                    output_parts.append("\n### External Links\n")
-                    for link in external_links:
-                        href = link.get("href", "")
-                        text = link.get("text", href)[:50]
-                        output_parts.append(f"- [{text}]({href})\n")
+                    write("\n### External Links\n")
+                    write(format_links(external_links))
 
         # Add images if requested
         if include_images and result.media:
-            images = result.media.get("images", [])[:10]
+            images = first_unique(result.media.get("images", []), "src", 10)
             if images:
-                output_parts.append("\n\n---\n## Images\n")
-                for img in images:
-                    src = img.get("src", "")
-                    alt = img.get("alt", "No description")
-                    output_parts.append(f"- ![{alt}]({src})\n")
+                write("\n\n---\n## Images\n")
+                write("".join(
+                    f"- ![{img.get('alt', 'No description')}]({img.get('src', '')})\n"
+                    for img in images
+                ))
 
-        return "".join(output_parts)
+        return buf.getvalue()
 
     except Exception as e:
         return f"Error crawling {url}: {str(e)}"
@@ -555,87 +1810,95 @@ async def crawl_multiple_pages(
     Returns:
         Combined markdown content from all pages
     """
-    max_concurrent = min(max_concurrent, MAX_CONCURRENT)
-    results = []
+    # Never more slots than pages; the batch holds them for its whole stream
+    max_concurrent = max(1, min(max_concurrent, MAX_CONCURRENT, len(urls)))
 
     try:
         crawler = await get_crawler()
 
+        # An explicit dispatcher caps concurrency; CrawlerRunConfig.semaphore_count
+        # is ignored by some Crawl4AI releases and turns 0 into 10 in others.
+        # stream=True yields each page as soon as it finishes
         config = CrawlerRunConfig(
             cache_mode=CacheMode.BYPASS,
             mean_delay=MEAN_DELAY,
+            stream=True,
+        )
+        dispatcher = SemaphoreDispatcher(semaphore_count=max_concurrent)
+
+        # Format each page as soon as its crawl finishes, and start storing
+        # successful pages right away so storage overlaps the remaining crawls
+        sections = io.StringIO()
+        write = sections.write
+        vector_tasks: List[asyncio.Task] = []
+        graph_tasks: List[asyncio.Task] = []
+        graph_pages: List[Tuple[str, str, Optional[str], Optional[str]]] = []
+        successful = 0
+
+        try:
+            # Pages this batch opens count against the limit single-page tools share
+            async with reserve_crawl_slots(max_concurrent):
+                async for result in await crawler.arun_many(urls=urls, config=config, dispatcher=dispatcher):
+                    title = (result.metadata or {}).get("title", "")
+                    write(f"## {title or result.url}\n**URL:** {result.url}\n")
+
+                    if result.success:
+                        successful += 1
+                        content = result.markdown or result.cleaned_html or ""
+                        crawled_at = utc_now_iso()
+
+                        if store_in_db:
+                            vector_tasks.append(asyncio.ensure_future(
+                                store_in_vector_db(result.url, content, title, crawled_at=crawled_at)
+                            ))
+
+                        # Graph pages are written GRAPH_WRITE_CHUNK at a time
+                        if store_in_graph:
+                            graph_pages.append((result.url, content, title, crawled_at))
+                            if len(graph_pages) == GRAPH_WRITE_CHUNK:
+                                graph_tasks.append(asyncio.ensure_future(store_pages_in_graph_db(graph_pages)))
+                                graph_pages = []
+
+                        write("\n")
+                        write_truncated(write, content, 10000)
+                        write("\n")
+                    else:
+                        write(f"\n**Error:** {result.error_message}\n")
+
+                    write("\n---\n\n")
+        finally:
+            # Even if the stream fails partway, write the buffered graph pages and
+            # wait for every store already started instead of orphaning them
+            if graph_pages:
+                graph_tasks.append(asyncio.ensure_future(store_pages_in_graph_db(graph_pages)))
+            vector_outcomes = await asyncio.gather(*vector_tasks, return_exceptions=True)
+            graph_outcomes = await asyncio.gather(*graph_tasks, return_exceptions=True)
+
+        for outcome in (*vector_outcomes, *graph_outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error("Batch crawl store failed", exc_info=outcome)
+        stored_vector = sum(1 for stored in vector_outcomes if stored is True)
+        stored_graph = sum(n for n in graph_outcomes if isinstance(n, int))
+
+        # Build combined output (summary first, then pages in completion order)
+        buf = io.StringIO()
+        write = buf.write
+        write("# Batch Crawl Results\n")
+        write(
+            f"**URLs crawled:** {len(urls)}\n"
+            f"**Successful:** {successful}\n"
+            f"**Failed:** {len(urls) - successful}\n"
         )
-
-        # Use semaphore for concurrency control
-        semaphore = asyncio.Semaphore(max_concurrent)
-
-        async def crawl_with_limit(url: str) -> Dict[str, Any]:
-            async with semaphore:
-                try:
-                    result = await crawler.arun(url=url, config=config)
-                    return {
-                        "url": url,
-                        "success": result.success,
-                        "title": result.metadata.get("title", ""),
-                        "content": result.markdown or result.cleaned_html or "",
-                        "error": result.error_message if not result.success else None
-                    }
-                except Exception as e:
-                    return {
-                        "url": url,
-                        "success": False,
-                        "title": "",
-                        "content": "",
-                        "error": str(e)
-                    }
-
-        # Crawl all URLs concurrently
-        tasks = [crawl_with_limit(url) for url in urls]
-        results = await asyncio.gather(*tasks)
-
-        # Build combined output
-        output_parts = [f"# Batch Crawl Results\n"]
-        output_parts.append(f"**URLs crawled:** {len(urls)}\n")
-        output_parts.append(f"**Successful:** {sum(1 for r in results if r['success'])}\n")
-        output_parts.append(f"**Failed:** {sum(1 for r in results if not r['success'])}\n")
 
         if store_in_db:
-            output_parts.append(f"**Storing in Vector DB:** Enabled\n")
+            write(f"**Stored in Vector DB:** {stored_vector}/{successful}\n")
         if store_in_graph:
-            output_parts.append(f"**Storing in Graph DB:** Enabled\n")
-
-        output_parts.append("---\n\n")
-
-        for result in results:
-            output_parts.append(f"## {result.get('title') or result['url']}\n")
-            output_parts.append(f"**URL:** {result['url']}\n")
-
-            if result["success"]:
-                content = truncate_content(result["content"], 10000)
-                output_parts.append(f"\n{content}\n")
-
-                # Store in databases if requested
-                if store_in_db:
-                    stored = await store_in_vector_db(
-                        result["url"],
-                        result["content"],
-                        result.get("title")
-                    )
-                    output_parts.append(f"*Vector DB: {'✓' if stored else '✗'}*\n")
-
-                if store_in_graph:
-                    stored = await store_in_graph_db(
-                        result["url"],
-                        result["content"],
-                        result.get("title")
-                    )
-                    output_parts.append(f"*Graph DB: {'✓' if stored else '✗'}*\n")
-            else:
-                output_parts.append(f"\n**Error:** {result['error']}\n")
+            write(f"**Stored in Graph DB:** {stored_graph}/{successful}\n")
 
-            output_parts.append("\n---\n\n")
+        write("---\n\n")
+        write(sections.getvalue())
 
-        return "".join(output_parts)
+        return buf.getvalue()
 
     except Exception as e:
         return f"Error in batch crawl: {str(e)}"
@@ -647,7 +1910,8 @@ async def smart_crawl(
     query: str,
     max_pages: int = 1,
     store_in_db: bool = False,
-    store_in_graph: bool = False
+    store_in_graph: bool = False,
+    force_refresh: bool = False
 ) -> str:
     """
     Adaptive crawling with query-based content filtering.
@@ -659,6 +1923,7 @@ async def smart_crawl(
         max_pages: Maximum pages to follow (default: 1)
         store_in_db: Store in Supabase vector DB for RAG (default: False)
         store_in_graph: Store in Neo4j knowledge graph (default: False)
+        force_refresh: Load the page even if it was crawled in the last PAGE_CACHE_TTL seconds
 
     Returns:
         Query-relevant content extracted from the page(s)
@@ -675,7 +1940,7 @@ async def smart_crawl(
             word_count_threshold=50,  # Skip very short content blocks
         )
 
-        result = await crawler.arun(url=url, config=config)
+        result = await fetch_page(crawler, url, config, force_refresh)
 
         if not result.success:
             return f"Error crawling {url}: {result.error_message}"
@@ -685,48 +1950,45 @@ async def smart_crawl(
         title = result.metadata.get("title", "")
 
         # Split into paragraphs and score by relevance
-        paragraphs = content.split("\n\n")
-        scored_paragraphs = []
+        scored_paragraphs = score_paragraphs(content, query_terms)
 
-        for para in paragraphs:
-            if len(para.strip()) < 50:
-                continue
-
-            para_lower = para.lower()
-            score = sum(1 for term in query_terms if term in para_lower)
-
-            if score > 0:
-                scored_paragraphs.append((score, para))
-
-        # Sort by relevance score
-        scored_paragraphs.sort(key=lambda x: x[0], reverse=True)
+        # Top 20 by relevance score (ties keep document order, like a stable sort)
+        top_paragraphs = nlargest(20, scored_paragraphs, key=itemgetter(0))
 
         # Build output
-        output_parts = [f"# Smart Crawl Results\n"]
-        output_parts.append(f"**Query:** {query}\n")
-        output_parts.append(f"**Source:** {url}\n")
-        output_parts.append(f"**Relevant sections found:** {len(scored_paragraphs)}\n")
-
-        # Store if requested
-        if store_in_db:
-            stored = await store_in_vector_db(url, content, title)
-            output_parts.append(f"**Vector DB:** {'✓ Stored' if stored else '✗ Not stored'}\n")
+        buf = io.StringIO()
+        write = buf.write
+        write("# Smart Crawl Results\n")
+        write(
+            f"**Query:** {query}\n"
+            f"**Source:** {url}\n"
+            f"**Relevant sections found:** {len(scored_paragraphs)}\n"
+        )
 
-        if store_in_graph:
-            stored = await store_in_graph_db(url, content, title)
-            output_parts.append(f"**Graph DB:** {'✓ Stored' if stored else '✗ Not stored'}\n")
+        # Store if requested (vector and graph writes run concurrently)
+        if store_in_db or store_in_graph:
+            stored_vector, stored_graph = await store_all(
+                url, content, title,
+                store_in_db=store_in_db,
+                store_in_graph=store_in_graph
+            )
+            if store_in_db:
+                write(f"**Vector DB:** {'✓ Stored' if stored_vector else '✗ Not stored'}\n")
+            if store_in_graph:
+                write(f"**Graph DB:** {'✓ Stored' if stored_graph else '✗ Not stored'}\n")
 
-        output_parts.append("---\n\n")
+        write("---\n\n")
 
-        if scored_paragraphs:
-            for score, para in scored_paragraphs[:20]:  # Top 20 relevant paragraphs
-                output_parts.append(f"{para}\n\n")
+        if top_paragraphs:
+            for score, para in top_paragraphs:
+                write(para)
+                write("\n\n")
         else:
             # If no relevant content found, return full content
-            output_parts.append("*No specifically relevant sections found. Full content:*\n\n")
-            output_parts.append(truncate_content(content, 30000))
+            write("*No specifically relevant sections found. Full content:*\n\n")
+            write_truncated(write, content, 30000)
 
-        return "".join(output_parts)
+        return buf.getvalue()
 
     except Exception as e:
         return f"Error in smart crawl: {str(e)}"
@@ -759,8 +2021,8 @@ async def extract_structured_data(
     try:
         crawler = await get_crawler()
 
-        # Create extraction strategy from schema
-        extraction_strategy = JsonCssExtractionStrategy(schema)
+        # Reuse the extraction strategy for schemas we have seen before
+        extraction_strategy = get_css_strategy(schema)
 
         config = CrawlerRunConfig(
             cache_mode=CacheMode.BYPASS,
@@ -768,7 +2030,7 @@ async def extract_structured_data(
             mean_delay=MEAN_DELAY,
         )
 
-        result = await crawler.arun(url=url, config=config)
+        result = await _session_pool.arun(crawler, url, config)
 
         if not result.success:
             return f"Error extracting from {url}: {result.error_message}"
@@ -778,8 +2040,8 @@ async def extract_structured_data(
 
         if extracted:
             try:
-                data = json.loads(extracted) if isinstance(extracted, str) else extracted
-                return json.dumps(data, indent=2)
+                data = json_loads(extracted) if isinstance(extracted, str) else extracted
+                return json_dumps_pretty(data)
             except json.JSONDecodeError:
                 return extracted
 
@@ -830,7 +2092,7 @@ async def extract_with_llm(
             mean_delay=MEAN_DELAY,
         )
 
-        result = await crawler.arun(url=url, config=config)
+        result = await _session_pool.arun(crawler, url, config)
 
         if not result.success:
             return f"Error extracting from {url}: {result.error_message}"
@@ -839,8 +2101,8 @@ async def extract_with_llm(
 
         if extracted:
             try:
-                data = json.loads(extracted) if isinstance(extracted, str) else extracted
-                return json.dumps(data, indent=2)
+                data = json_loads(extracted) if isinstance(extracted, str) else extracted
+                return json_dumps_pretty(data)
             except json.JSONDecodeError:
                 return extracted
 
@@ -877,14 +2139,14 @@ async def get_page_screenshot(
             mean_delay=MEAN_DELAY,
         )
 
-        result = await crawler.arun(url=url, config=config)
+        result = await _session_pool.arun(crawler, url, config)
 
         if not result.success:
             return f"Error capturing screenshot of {url}: {result.error_message}"
 
         if result.screenshot:
             # Return as data URI for easy use
-            return f"data:image/png;base64,{result.screenshot}"
+            return f"data:image/png;base64,{to_base64(result.screenshot)}"
 
         return "No screenshot was captured"
 
@@ -917,13 +2179,14 @@ async def get_page_pdf(
             mean_delay=MEAN_DELAY,
         )
 
-        result = await crawler.arun(url=url, config=config)
+        result = await _session_pool.arun(crawler, url, config)
 
         if not result.success:
             return f"Error generating PDF of {url}: {result.error_message}"
 
         if result.pdf:
-            return f"data:application/pdf;base64,{result.pdf}"
+            # Crawl4AI returns the PDF as raw bytes
+            return f"data:application/pdf;base64,{to_base64(result.pdf)}"
 
         return "No PDF was generated"
 
@@ -943,7 +2206,7 @@ async def search_crawled_content(
 
     Args:
         query: Search query
-        limit: Maximum number of results (default: 5)
+        limit: Maximum number of results (default: 5, max: 50)
         source_filter: Optional URL pattern to filter by
 
     Returns:
@@ -957,42 +2220,86 @@ async def search_crawled_content(
         return "Error: Supabase connection not available"
 
     try:
-        # Generate query embedding using Azure OpenAI
-        embedding = await generate_embedding(query)
+        # Generate (or reuse) the query embedding using Azure OpenAI; when it
+        # is not cached, reconnect to Supabase meanwhile instead of after it
+        embedding = await get_query_embedding(query, on_miss=warm_supabase_connection)
         if not embedding:
             return "Error: Failed to generate query embedding"
 
-        # Search in Supabase using vector similarity
-        result = supabase.rpc(
+        # Search in Supabase using vector similarity (supabase-py is synchronous)
+        request = supabase.rpc(
             "match_documents",
             {
                 "query_embedding": embedding,
-                "match_count": limit,
-                "filter_url": source_filter
+                "match_count": max(1, min(limit, SEARCH_MAX_RESULTS)),
+                "filter_url": source_filter,
+                "content_preview_chars": SEARCH_PREVIEW_CHARS
             }
-        ).execute()
+        )
+        result = await asyncio.to_thread(request.execute)
 
         if not result.data:
             return "No matching content found"
 
         # Format results
-        output_parts = [f"# Search Results for: {query}\n\n"]
+        buf = io.StringIO()
+        write = buf.write
+        write(f"# Search Results for: {query}\n\n")
 
         for i, doc in enumerate(result.data, 1):
-            output_parts.append(f"## Result {i}\n")
-            output_parts.append(f"**URL:** {doc.get('url', 'Unknown')}\n")
-            output_parts.append(f"**Title:** {doc.get('title', 'Untitled')}\n")
-            output_parts.append(f"**Similarity:** {doc.get('similarity', 0):.3f}\n\n")
+            write(
+                f"## Result {i}\n"
+                f"**URL:** {doc.get('url', 'Unknown')}\n"
+                f"**Title:** {doc.get('title', 'Untitled')}\n"
+                f"**Similarity:** {doc.get('similarity', 0):.3f}\n\n"
+            )
 
-            content = doc.get('content', '')[:2000]
-            output_parts.append(f"{content}\n\n---\n\n")
+            write(doc.get('content', '')[:SEARCH_PREVIEW_CHARS])
+            write("\n\n---\n\n")
 
-        return "".join(output_parts)
+        return buf.getvalue()
 
     except Exception as e:
         return f"Error in RAG search: {str(e)}"
 
 
+# Graph search queries, one fixed text per search type so Neo4j's plan
+# cache is hit on every call (inputs are always passed as parameters)
+TOPIC_SEARCH_CYPHER = """
+MATCH (t:Topic)
+WHERE toLower(t.name) CONTAINS toLower($query)
+OPTIONAL MATCH (p:WebPage)-[:COVERS_TOPIC]->(t)
+RETURN t.name as topic, collect(DISTINCT {url: p.url, title: p.title})[0..$limit] as pages
+LIMIT $limit
+"""
+
+DOMAIN_SEARCH_CYPHER = """
+MATCH (d:Domain)
+WHERE toLower(d.name) CONTAINS toLower($query)
+OPTIONAL MATCH (p:WebPage)-[:BELONGS_TO]->(d)
+RETURN d.name as domain, collect(DISTINCT {url: p.url, title: p.title})[0..$limit] as pages
+LIMIT $limit
+"""
+
+PAGE_SEARCH_CYPHER = """
+MATCH (p:WebPage)
+WHERE toLower(p.url) CONTAINS toLower($query)
+   OR toLower(p.title) CONTAINS toLower($query)
+OPTIONAL MATCH (p)-[:COVERS_TOPIC]->(t:Topic)
+OPTIONAL MATCH (p)-[:LINKS_TO]->(linked:WebPage)
+RETURN p.url as url, p.title as title,
+       collect(DISTINCT t.name) as topics,
+       collect(DISTINCT linked.url)[0..5] as links
+LIMIT $limit
+"""
+
+GRAPH_SEARCH_CYPHER = {
+    "topic": TOPIC_SEARCH_CYPHER,
+    "domain": DOMAIN_SEARCH_CYPHER,
+    "page": PAGE_SEARCH_CYPHER,
+}
+
+
 @mcp.tool()
 async def search_knowledge_graph(
     query: str,
@@ -1019,87 +2326,73 @@ async def search_knowledge_graph(
         return "Error: Neo4j connection not available"
 
     try:
-        with driver.session() as session:
-            if search_type == "topic":
-                result = session.run("""
-                    MATCH (t:Topic)
-                    WHERE toLower(t.name) CONTAINS toLower($query)
-                    OPTIONAL MATCH (p:WebPage)-[:COVERS_TOPIC]->(t)
-                    RETURN t.name as topic, collect(DISTINCT {url: p.url, title: p.title})[0..$limit] as pages
-                    LIMIT $limit
-                """, query=query, limit=limit)
-
-            elif search_type == "domain":
-                result = session.run("""
-                    MATCH (d:Domain)
-                    WHERE toLower(d.name) CONTAINS toLower($query)
-                    OPTIONAL MATCH (p:WebPage)-[:BELONGS_TO]->(d)
-                    RETURN d.name as domain, collect(DISTINCT {url: p.url, title: p.title})[0..$limit] as pages
-                    LIMIT $limit
-                """, query=query, limit=limit)
-
-            else:  # page
-                result = session.run("""
-                    MATCH (p:WebPage)
-                    WHERE toLower(p.url) CONTAINS toLower($query)
-                       OR toLower(p.title) CONTAINS toLower($query)
-                    OPTIONAL MATCH (p)-[:COVERS_TOPIC]->(t:Topic)
-                    OPTIONAL MATCH (p)-[:LINKS_TO]->(linked:WebPage)
-                    RETURN p.url as url, p.title as title,
-                           collect(DISTINCT t.name) as topics,
-                           collect(DISTINCT linked.url)[0..5] as links
-                    LIMIT $limit
-                """, query=query, limit=limit)
-
-            records = list(result)
+        async with driver.session(default_access_mode=READ_ACCESS) as session:
+            cypher = GRAPH_SEARCH_CYPHER.get(search_type, PAGE_SEARCH_CYPHER)
+            result = await session.run(cypher, query=query, limit=limit)
+            records = [record async for record in result]
 
         # Format results
-        output_parts = [f"# Knowledge Graph Search\n"]
-        output_parts.append(f"**Query:** {query}\n")
-        output_parts.append(f"**Type:** {search_type}\n")
-        output_parts.append(f"**Results:** {len(records)}\n")
-        output_parts.append("---\n\n")
+        buf = io.StringIO()
+        write = buf.write
+        write(
+            "# Knowledge Graph Search\n"
+            f"**Query:** {query}\n"
+            f"**Type:** {search_type}\n"
+            f"**Results:** {len(records)}\n"
+            "---\n\n"
+        )
 
         if not records:
-            return "".join(output_parts) + "No results found."
+            write("No results found.")
+            return buf.getvalue()
 
         for record in records:
             if search_type == "topic":
-                output_parts.append(f"## Topic: {record['topic']}\n")
+                write(f"## Topic: {record['topic']}\n")
                 pages = record['pages']
                 if pages:
-                    output_parts.append("**Related Pages:**\n")
-                    for page in pages:
-                        if page['url']:
-                            output_parts.append(f"- [{page['title'] or page['url']}]({page['url']})\n")
+                    write("**Related Pages:**\n")
+                    write("".join(
+                        f"- [{page['title'] or page['url']}]({page['url']})\n"
+                        for page in pages if page['url']
+                    ))
 
             elif search_type == "domain":
-                output_parts.append(f"## Domain: {record['domain']}\n")
+                write(f"## Domain: {record['domain']}\n")
                 pages = record['pages']
                 if pages:
-                    output_parts.append("**Pages:**\n")
-                    for page in pages:
-                        if page['url']:
-                            output_parts.append(f"- [{page['title'] or page['url']}]({page['url']})\n")
+                    write("**Pages:**\n")
+                    write("".join(
+                        f"- [{page['title'] or page['url']}]({page['url']})\n"
+                        for page in pages if page['url']
+                    ))
 
             else:  # page
-                output_parts.append(f"## {record['title'] or record['url']}\n")
-                output_parts.append(f"**URL:** {record['url']}\n")
+                write(f"## {record['title'] or record['url']}\n")
+                write(f"**URL:** {record['url']}\n")
                 if record['topics']:
-                    output_parts.append(f"**Topics:** {', '.join(record['topics'])}\n")
+                    write(f"**Topics:** {', '.join(record['topics'])}\n")
                 if record['links']:
-                    output_parts.append("**Links to:**\n")
-                    for link in record['links']:
-                        output_parts.append(f"- {link}\n")
+                    write("**Links to:**\n")
+                    write("".join(f"- {link}\n" for link in record['links']))
 
-            output_parts.append("\n")
+            write("\n")
 
-        return "".join(output_parts)
+        return buf.getvalue()
 
     except Exception as e:
         return f"Error in graph search: {str(e)}"
 
 
+# Labels this server writes. Each count is its own subquery, so an empty
+# label reports 0 instead of removing the row, and a bare count over one
+# label is answered from the count store instead of scanning nodes
+GRAPH_COUNT_LABELS = ("WebPage", "Domain", "Topic")
+GRAPH_COUNT_CYPHER = "RETURN " + ", ".join(
+    f"COUNT {{ (:{label}) }} AS {label}" for label in GRAPH_COUNT_LABELS
+)
+
+
 @mcp.tool()
 async def get_rag_status() -> str:
     """
@@ -1108,74 +2401,75 @@ async def get_rag_status() -> str:
     Returns:
         Status information for each RAG component
     """
-    output_parts = ["# RAG Integration Status\n\n"]
+    buf = io.StringIO()
+    write = buf.write
+    write("# RAG Integration Status\n\n")
 
     # Azure OpenAI Status
-    output_parts.append("## Azure OpenAI (Embeddings)\n")
+    write("## Azure OpenAI (Embeddings)\n")
     if AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY:
-        output_parts.append(f"- **Status:** ✓ Configured\n")
-        output_parts.append(f"- **Endpoint:** {AZURE_OPENAI_ENDPOINT[:50]}...\n")
-        output_parts.append(f"- **Model:** {AZURE_EMBEDDING_DEPLOYMENT}\n")
+        write("- **Status:** ✓ Configured\n")
+        write(f"- **Endpoint:** {AZURE_OPENAI_ENDPOINT[:50]}...\n")
+        write(f"- **Model:** {AZURE_EMBEDDING_DEPLOYMENT}\n")
     else:
-        output_parts.append("- **Status:** ✗ Not configured\n")
-        output_parts.append("- **Required:** AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY\n")
+        write("- **Status:** ✗ Not configured\n")
+        write("- **Required:** AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY\n")
 
-    output_parts.append("\n")
+    write("\n")
 
     # Supabase Status
-    output_parts.append("## Supabase (Vector DB)\n")
+    write("## Supabase (Vector DB)\n")
     if SUPABASE_URL and SUPABASE_SERVICE_KEY:
         supabase = get_supabase()
         if supabase:
-            output_parts.append(f"- **Status:** ✓ Connected\n")
-            output_parts.append(f"- **URL:** {SUPABASE_URL}\n")
+            write("- **Status:** ✓ Connected\n")
+            write(f"- **URL:** {SUPABASE_URL}\n")
             try:
                 # Check if table exists
-                result = supabase.table("crawled_content").select("id").limit(1).execute()
+                query = supabase.table("crawled_content").select("id").limit(1)
+                result = await asyncio.to_thread(query.execute)
                 count = len(result.data) if result.data else 0
-                output_parts.append(f"- **Table:** crawled_content (accessible)\n")
+                write("- **Table:** crawled_content (accessible)\n")
             except Exception as e:
-                output_parts.append(f"- **Table:** Error - {str(e)[:50]}\n")
+                write(f"- **Table:** Error - {str(e)[:50]}\n")
         else:
-            output_parts.append("- **Status:** ✗ Connection failed\n")
+            write("- **Status:** ✗ Connection failed\n")
     else:
-        output_parts.append("- **Status:** ✗ Not configured\n")
-        output_parts.append("- **Required:** SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY\n")
+        write("- **Status:** ✗ Not configured\n")
+        write("- **Required:** SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY\n")
 
-    output_parts.append("\n")
+    write("\n")
 
     # Neo4j Status
-    output_parts.append("## Neo4j (Graph DB)\n")
+    write("## Neo4j (Graph DB)\n")
     if NEO4J_URI and NEO4J_PASSWORD:
         driver = get_neo4j_driver()
         if driver:
             try:
-                with driver.session() as session:
-                    result = session.run("RETURN 1 as test")
-                    result.single()
-                output_parts.append(f"- **Status:** ✓ Connected\n")
-                output_parts.append(f"- **URI:** {NEO4J_URI}\n")
-
-                # Get node counts
-                with driver.session() as session:
-                    counts = session.run("""
-                        MATCH (n)
-                        RETURN labels(n)[0] as label, count(*) as count
-                    """)
-                    for record in counts:
-                        output_parts.append(f"- **{record['label']}:** {record['count']} nodes\n")
+                # One read session for the connectivity check and node counts
+                async with driver.session(default_access_mode=READ_ACCESS) as session:
+                    result = await session.run("RETURN 1 as test")
+                    await result.single()
+                    write("- **Status:** ✓ Connected\n")
+                    write(f"- **URI:** {NEO4J_URI}\n")
+
+                    # Node counts per label, always exactly one row
+                    counts = await session.run(GRAPH_COUNT_CYPHER)
+                    record = await counts.single()
+                    for label in GRAPH_COUNT_LABELS:
+                        write(f"- **{label}:** {record[label]} nodes\n")
             except Exception as e:
-                output_parts.append(f"- **Status:** ✗ Connection error - {str(e)[:50]}\n")
+                write(f"- **Status:** ✗ Connection error - {str(e)[:50]}\n")
         else:
-            output_parts.append("- **Status:** ✗ Driver not initialized\n")
+            write("- **Status:** ✗ Driver not initialized\n")
     else:
-        output_parts.append("- **Status:** ✗ Not configured\n")
-        output_parts.append("- **Required:** NEO4J_URI, NEO4J_PASSWORD\n")
+        write("- **Status:** ✗ Not configured\n")
+        write("- **Required:** NEO4J_URI, NEO4J_PASSWORD\n")
 
-    output_parts.append("\n---\n")
-    output_parts.append("\n**Credentials loaded from:** Global ~/.claude/.env (with local .env override)\n")
+    write("\n---\n")
+    write("\n**Credentials loaded from:** Global ~/.claude/.env (with local .env override)\n")
 
-    return "".join(output_parts)
+    return buf.getvalue()
 
 
 # =============================================================================
@@ -1185,37 +2479,92 @@ async def get_rag_status() -> str:
 @mcp.on_startup()
 async def startup():
     """Initialize resources on server startup."""
-    print("Crawl4AI MCP Server starting...")
-    print(f"  RAG (Supabase + Azure OpenAI): {'Available' if RAG_AVAILABLE else 'Not configured'}")
-    print(f"  Graph RAG (Neo4j): {'Available' if GRAPH_RAG_AVAILABLE else 'Not configured'}")
+    logger.info("Crawl4AI MCP Server starting...")
+    logger.info("  RAG (Supabase + Azure OpenAI): %s", "Available" if RAG_AVAILABLE else "Not configured")
+    logger.info("  Graph RAG (Neo4j): %s", "Available" if GRAPH_RAG_AVAILABLE else "Not configured")
 
 
 @mcp.on_shutdown()
 async def shutdown():
     """Clean up resources on server shutdown."""
-    global _crawler, _neo4j_driver
+    global _crawler, _neo4j_driver, _azure_client, _supabase, _supabase_http, _embedding_disk_cache
+
+    # Let background stores finish, then flush queued vector DB writes
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+    if _embedding_batcher:
+        await _embedding_batcher.close()
 
     if _crawler:
+        await _session_pool.close(_crawler)
         await _crawler.close()
         _crawler = None
 
     if _neo4j_driver:
-        _neo4j_driver.close()
+        await _neo4j_driver.close()
         _neo4j_driver = None
 
-    print("Crawl4AI MCP Server stopped")
+    # The Azure OpenAI client is shared by every embedding call; release its pool once
+    if _azure_client:
+        await _azure_client.close()
+        _azure_client = None
+
+    if _supabase_http:
+        _supabase_http.close()
+        _supabase_http = None
+        _supabase = None
+
+    if _embedding_disk_cache:
+        _embedding_disk_cache.close()
+        _embedding_disk_cache = None
+
+    logger.info("Crawl4AI MCP Server stopped")
 
 
 # =============================================================================
 # Main Entry Point
 # =============================================================================
 
+def configure_logging() -> Optional[logging.handlers.QueueListener]:
+    """
+    Send this module's log records through a queue to a stderr handler.
+
+    Coroutines only enqueue records; formatting and the blocking write happen
+    on the listener's thread. Returns the started listener.
+    """
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers):
+        return None
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
 def main():
     """Run the MCP server."""
-    if TRANSPORT == "sse":
-        mcp.run(transport="sse")
-    else:
-        mcp.run(transport="stdio")
+    listener = configure_logging()
+
+    # libuv-backed event loop for all the crawl / embedding / database I/O
+    if UVLOOP_AVAILABLE:
+        uvloop.install()
+
+    try:
+        if TRANSPORT == "sse":
+            mcp.run(transport="sse")
+        else:
+            mcp.run(transport="stdio")
+    finally:
+        # Flush queued records before the process exits
+        if listener:
+            listener.stop()
 
 
 if __name__ == "__main__":
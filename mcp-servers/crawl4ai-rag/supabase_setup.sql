@@ -3,6 +3,7 @@
 -- =============================================================================
 -- Run this SQL in your Supabase SQL Editor to enable RAG capabilities
 -- Compatible with Azure OpenAI text-embedding-3-small (1536 dimensions)
+-- Requires pgvector 0.7+ (embeddings are stored as halfvec)
 -- =============================================================================
 
 -- Enable the pgvector extension for vector similarity search
@@ -11,30 +12,68 @@ CREATE EXTENSION IF NOT EXISTS vector;
 -- -----------------------------------------------------------------------------
 -- Table: crawled_content
 -- Stores crawled web pages with embeddings for semantic search
+-- Each page is split into chunks; one row per (url, chunk_index)
 -- -----------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS crawled_content (
     id BIGSERIAL PRIMARY KEY,
-    url TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    chunk_index INT NOT NULL DEFAULT 0,
     title TEXT,
     content TEXT NOT NULL,
-    embedding vector(1536),  -- Azure OpenAI text-embedding-3-small dimension
+    content_sha256 TEXT,     -- SHA-256 of the embedded text, used as an embedding cache key
+    embedding halfvec(1536), -- text-embedding-3-small dimension, stored at half precision
     crawled_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     metadata JSONB DEFAULT '{}'::jsonb
 );
 
+-- Upgrade tables created before the embedding cache existed
+ALTER TABLE crawled_content ADD COLUMN IF NOT EXISTS content_sha256 TEXT;
+
+-- Upgrade tables created before pages were chunked (one row per url)
+ALTER TABLE crawled_content ADD COLUMN IF NOT EXISTS chunk_index INT NOT NULL DEFAULT 0;
+ALTER TABLE crawled_content DROP CONSTRAINT IF EXISTS crawled_content_url_key;
+
+-- Upgrade tables created with full-precision vector(1536) embeddings
+-- (halves storage; the HNSW index is rebuilt below)
+DO $$
+BEGIN
+    IF (
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'crawled_content'::regclass AND attname = 'embedding'
+    ) = 'vector(1536)' THEN
+        -- Indexes built on the vector opclasses block the type change
+        DROP INDEX IF EXISTS idx_crawled_content_embedding;
+        DROP INDEX IF EXISTS idx_crawled_content_embedding_ip;
+        ALTER TABLE crawled_content
+            ALTER COLUMN embedding TYPE halfvec(1536) USING embedding::halfvec(1536);
+    END IF;
+END;
+$$;
+
+-- One row per page chunk (upsert conflict target)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_crawled_content_url_chunk
+    ON crawled_content(url, chunk_index);
+
 -- Index for faster URL lookups
 CREATE INDEX IF NOT EXISTS idx_crawled_content_url ON crawled_content(url);
 
+-- Index for embedding cache lookups by content hash
+CREATE INDEX IF NOT EXISTS idx_crawled_content_sha256 ON crawled_content(content_sha256);
+
 -- Index for vector similarity search (using HNSW for better performance)
 -- Note: HNSW is faster for queries but slower for inserts
-CREATE INDEX IF NOT EXISTS idx_crawled_content_embedding ON crawled_content
-    USING hnsw (embedding vector_cosine_ops)
+-- Embeddings are stored unit-length (the server normalizes them), so inner
+-- product ranks exactly like cosine without computing norms per candidate
+DROP INDEX IF EXISTS idx_crawled_content_embedding;  -- Old cosine-distance index
+CREATE INDEX IF NOT EXISTS idx_crawled_content_embedding_ip ON crawled_content
+    USING hnsw (embedding halfvec_ip_ops)
     WITH (m = 16, ef_construction = 64);
 
 -- Alternative: IVFFlat index (faster inserts, good for smaller datasets)
--- CREATE INDEX IF NOT EXISTS idx_crawled_content_embedding ON crawled_content
---     USING ivfflat (embedding vector_cosine_ops)
+-- CREATE INDEX IF NOT EXISTS idx_crawled_content_embedding_ip ON crawled_content
+--     USING ivfflat (embedding halfvec_ip_ops)
 --     WITH (lists = 100);
 
 -- Index for timestamp-based queries
@@ -47,11 +86,19 @@ CREATE INDEX IF NOT EXISTS idx_crawled_content_title ON crawled_content USING gi
 -- Function: match_documents
 -- Semantic search function for finding similar content
 -- Compatible with the crawl4ai_mcp_server.py search_crawled_content tool
+-- Only the first content_preview_chars of each chunk are returned, and
+-- match_count is clamped to 1..50 so a bad argument cannot trigger a big scan
+-- The query embedding is accepted as vector and compared at half precision;
+-- both sides are unit-length, so similarity = inner product (= cosine)
 -- -----------------------------------------------------------------------------
+-- Drop the old 3-argument version so PostgREST does not see two overloads
+DROP FUNCTION IF EXISTS match_documents(vector, INT, TEXT);
+
 CREATE OR REPLACE FUNCTION match_documents(
     query_embedding vector(1536),
     match_count INT DEFAULT 5,
-    filter_url TEXT DEFAULT NULL
+    filter_url TEXT DEFAULT NULL,
+    content_preview_chars INT DEFAULT 2000
 )
 RETURNS TABLE (
     id BIGINT,
@@ -62,19 +109,27 @@ RETURNS TABLE (
 )
 LANGUAGE plpgsql
 AS $$
+DECLARE
+    query_half halfvec(1536) := query_embedding::halfvec(1536);
 BEGIN
+    match_count := LEAST(GREATEST(match_count, 1), 50);
+
+    -- Candidate list size for the HNSW scan (pgvector default is 40);
+    -- keep it comfortably above match_count so recall does not drop
+    PERFORM set_config('hnsw.ef_search', GREATEST(40, match_count * 4)::TEXT, true);
+
     RETURN QUERY
     SELECT
         cc.id,
         cc.url,
         cc.title,
-        cc.content,
-        1 - (cc.embedding <=> query_embedding) AS similarity
+        LEFT(cc.content, content_preview_chars) AS content,
+        -(cc.embedding <#> query_half) AS similarity  -- <#> is the negative inner product
     FROM crawled_content cc
     WHERE
         cc.embedding IS NOT NULL
         AND (filter_url IS NULL OR cc.url ILIKE '%' || filter_url || '%')
-    ORDER BY cc.embedding <=> query_embedding
+    ORDER BY cc.embedding <#> query_half
     LIMIT match_count;
 END;
 $$;
@@ -84,12 +139,17 @@ $$;
 -- Insert or update crawled content with embedding
 -- Called by the MCP server's store_in_vector_db function
 -- -----------------------------------------------------------------------------
+-- Drop the old 5-argument version (ON CONFLICT (url)) so PostgREST does not
+-- see two overloads
+DROP FUNCTION IF EXISTS upsert_crawled_content(TEXT, TEXT, TEXT, vector, JSONB);
+
 CREATE OR REPLACE FUNCTION upsert_crawled_content(
     p_url TEXT,
     p_title TEXT,
     p_content TEXT,
     p_embedding vector(1536),
-    p_metadata JSONB DEFAULT '{}'::jsonb
+    p_metadata JSONB DEFAULT '{}'::jsonb,
+    p_chunk_index INT DEFAULT 0
 )
 RETURNS BIGINT
 LANGUAGE plpgsql
@@ -97,9 +157,9 @@ AS $$
 DECLARE
     result_id BIGINT;
 BEGIN
-    INSERT INTO crawled_content (url, title, content, embedding, metadata, updated_at)
-    VALUES (p_url, p_title, p_content, p_embedding, p_metadata, NOW())
-    ON CONFLICT (url) DO UPDATE
+    INSERT INTO crawled_content (url, chunk_index, title, content, embedding, metadata, updated_at)
+    VALUES (p_url, p_chunk_index, p_title, p_content, p_embedding::halfvec(1536), p_metadata, NOW())
+    ON CONFLICT (url, chunk_index) DO UPDATE
     SET
         title = EXCLUDED.title,
         content = EXCLUDED.content,
@@ -112,6 +172,31 @@ BEGIN
 END;
 $$;
 
+-- -----------------------------------------------------------------------------
+-- Function: prune_crawled_chunks
+-- Remove chunks beyond each page's current chunk count (page got shorter)
+-- Called by the MCP server after each batched upsert
+-- -----------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION prune_crawled_chunks(
+    p_urls TEXT[],
+    p_chunk_counts INT[]
+)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    deleted_count INT;
+BEGIN
+    DELETE FROM crawled_content cc
+    USING unnest(p_urls, p_chunk_counts) AS keep(url, chunk_count)
+    WHERE cc.url = keep.url
+        AND cc.chunk_index >= keep.chunk_count;
+
+    GET DIAGNOSTICS deleted_count = ROW_COUNT;
+    RETURN deleted_count;
+END;
+$$;
+
 -- -----------------------------------------------------------------------------
 -- Function: get_recent_crawls
 -- Get recently crawled pages
@@ -129,6 +214,7 @@ LANGUAGE sql
 AS $$
     SELECT id, url, title, crawled_at
     FROM crawled_content
+    WHERE chunk_index = 0
     ORDER BY crawled_at DESC
     LIMIT limit_count;
 $$;
@@ -152,6 +238,7 @@ AS $$
     SELECT id, url, title, crawled_at
     FROM crawled_content
     WHERE url ILIKE '%' || domain_pattern || '%'
+        AND chunk_index = 0
     ORDER BY crawled_at DESC
     LIMIT limit_count;
 $$;
@@ -171,8 +258,8 @@ RETURNS TABLE (
 LANGUAGE sql
 AS $$
     SELECT
-        COUNT(*) as total_pages,
-        COUNT(embedding) as pages_with_embeddings,
+        COUNT(DISTINCT url) as total_pages,
+        COUNT(DISTINCT url) FILTER (WHERE embedding IS NOT NULL) as pages_with_embeddings,
         COUNT(DISTINCT regexp_replace(url, '^https?://([^/]+).*', '\1')) as unique_domains,
         MIN(crawled_at) as oldest_crawl,
         MAX(crawled_at) as newest_crawl
@@ -241,8 +328,9 @@ $$;
 -- Search for similar content:
 -- SELECT * FROM match_documents(
 --     '[0.1, 0.2, ...]'::vector(1536),  -- Your query embedding
---     5,                                  -- Number of results
---     'anthropic.com'                     -- Optional URL filter
+--     5,                                  -- Number of results (max 50)
+--     'anthropic.com',                    -- Optional URL filter
+--     2000                                -- Characters of content per result
 -- );
 --
 -- Get recent crawls:
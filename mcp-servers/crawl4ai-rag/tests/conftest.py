@@ -0,0 +1,99 @@
+"""
+Shared fixtures for the Crawl4AI MCP Server tests.
+"""
+
+from pathlib import Path
+from types import MappingProxyType, SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from src.crawl4ai_mcp_server import _page_cache
+
+INTEGRATION_DIR = Path(__file__).parent / "integration"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-integration",
+        action="store_true",
+        default=False,
+        help="collect tests/integration (network access, live Supabase / Neo4j / Azure OpenAI)",
+    )
+
+
+def pytest_ignore_collect(collection_path, config):
+    """Skip even importing the integration tests unless they were asked for."""
+    if collection_path == INTEGRATION_DIR and not config.getoption("--run-integration"):
+        return True
+    return None
+
+
+def pytest_collection_modifyitems(config, items):
+    """Naming tests/integration on the command line still needs --run-integration."""
+    if config.getoption("--run-integration"):
+        return
+    skip = pytest.mark.skip(reason="needs --run-integration")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def clear_page_cache():
+    """Crawl results are cached per URL; keep mocked pages from leaking between tests."""
+    _page_cache.clear()
+    yield
+    _page_cache.clear()
+
+
+# Read-only defaults shared by every result (tools only read them)
+NO_METADATA = MappingProxyType({})
+NO_LINKS = MappingProxyType({"internal": (), "external": ()})
+NO_MEDIA = MappingProxyType({"images": ()})
+
+
+def _make_result(**fields):
+    """A Crawl4AI result stand-in: a successful, empty page unless fields say otherwise."""
+    defaults = {
+        "url": None,
+        "success": True,
+        "markdown": "",
+        "cleaned_html": None,
+        "extracted_content": None,
+        "error_message": None,
+        "metadata": NO_METADATA,
+        "links": NO_LINKS,
+        "media": NO_MEDIA,
+    }
+    defaults.update(fields)
+    return SimpleNamespace(**defaults)
+
+
+@pytest.fixture
+def make_result():
+    """
+    Factory for crawl results. Plain namespaces are much cheaper than
+    MagicMocks, and a misspelled attribute fails loudly instead of returning
+    a truthy mock.
+    """
+    return _make_result
+
+
+def make_mock_crawler(result=None):
+    """An AsyncWebCrawler stand-in whose arun resolves to result."""
+    crawler = AsyncMock()
+    crawler.arun.return_value = result
+    return crawler
+
+
+@pytest.fixture
+def mock_crawler():
+    """
+    Patch get_crawler with a fresh mock crawler for one test.
+    Set mock_crawler.arun.return_value (or arun_many) to the page(s) to return.
+    Function-scoped so call counts never carry over between tests.
+    """
+    crawler = make_mock_crawler()
+    with patch("src.crawl4ai_mcp_server.get_crawler", return_value=crawler):
+        yield crawler
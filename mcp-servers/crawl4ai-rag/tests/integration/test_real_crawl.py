@@ -0,0 +1,61 @@
+"""
+Integration tests for Crawl4AI MCP Server v2.0 (real network and services).
+
+Not collected by default. Run with: pytest tests/integration --run-integration
+"""
+
+import asyncio
+
+import pytest
+
+from src.crawl4ai_mcp_server import _background_tasks, crawl_single_page, get_supabase
+
+pytestmark = pytest.mark.integration
+
+URL = "https://example.com"
+
+
+class TestIntegration:
+    """Integration tests (require network access)."""
+
+    @pytest.mark.asyncio
+    async def test_real_crawl(self):
+        """Test real crawl."""
+        result = await crawl_single_page(URL)
+        assert "Example Domain" in result
+
+    @pytest.mark.asyncio
+    async def test_real_crawl_with_vector_storage(self):
+        """Test real crawl with vector storage (requires Supabase and Azure OpenAI)."""
+        result = await crawl_single_page(
+            URL,
+            store_in_db=True
+        )
+        # Embedding runs in the background after the tool returns
+        assert "Vector DB:** ⏳ Queued" in result
+
+        # The placeholder says nothing about the store itself; wait for it
+        # and check the chunk rows actually landed
+        outcomes = await asyncio.gather(*_background_tasks)
+        assert outcomes and all(outcomes)
+
+        query = (
+            get_supabase().table("crawled_content")
+            .select("chunk_index, content, embedding")
+            .eq("url", URL)
+            .order("chunk_index")
+        )
+        rows = (await asyncio.to_thread(query.execute)).data
+        assert rows
+        assert [row["chunk_index"] for row in rows] == list(range(len(rows)))
+        assert all(row["embedding"] for row in rows)
+        assert "Example Domain" in "".join(row["content"] for row in rows)
+
+    @pytest.mark.asyncio
+    async def test_real_crawl_with_graph_storage(self):
+        """Test real crawl with graph storage (requires Neo4j)."""
+        result = await crawl_single_page(
+            URL,
+            store_in_graph=True
+        )
+        assert "Graph DB:** ✓ Yes" in result